@@ -7,6 +7,8 @@ import argparse
 from argparse import RawTextHelpFormatter
 from datetime import datetime, timedelta
 from tvhc.htspclient import *
+from tvhc import tvhcquery, tvhclib, tvhcoutput
+from tvhc.htspbulk import print_progress
 
 # Defaults
 FORMAT_REC = "{id:>6}: {startdate} - {title} ({length})"
@@ -23,7 +25,9 @@ parser.add_argument('--machine', '-m', type = str,
                     help = 'Specifies the machine. Default is "localhost:9982"')
 
 parser.add_argument('--query', '-q', type = str, action = 'append',
-                    help = 'One or more queries like "field:value". String values are compared by regex. Use < for lower, > for greater and +/- for relative time deltas.')
+                    help = 'One or more queries like "field:value". String values are compared by regex. Use < for lower, > for greater, '
+                           'low..high for ranges and +/- for relative time deltas. Prefix "!" negates, "||" separates alternatives. '
+                           'Also "sort:field,-field", "limit:n", "next" and "all".')
 
 parser.add_argument('--type', '-t', type = str,
                     default = 'rec', choices = ['rec', 'chn'],
@@ -31,7 +35,12 @@ parser.add_argument('--type', '-t', type = str,
 
 parser.add_argument('--format', '-f', type = str,
                     default = None,
-                    help = 'Defines printformat for found items. Format is described in python docs for string.format(). Available Templates are "full" or "json".')
+                    help = 'Defines printformat for found items. Format is described in python docs for string.format(). Available Templates are "full",\n'
+                           'or streamed "json", "jsonl", "csv" and "htsp" (binary).')
+
+parser.add_argument('--columns', type = str,
+                    default = None,
+                    help = 'Comma separated fields for json, jsonl, csv and htsp output. Default are all fields of the first item.')
 
 parser.add_argument('--delete', action='store_true', 
                     default = False,
@@ -50,6 +59,8 @@ parser.add_argument('--wakeup', action='store_true',
 #parser.add_argument('--remove', '-r', action = 'store', default = None, choices = ['rec'], help = "removes an item. Use with --id.")
 #parser.add_argument('--id', action = 'store', default = None, help = 'specifies the id of an item.')
 
+tvhclib.add_client_arguments(parser)
+
 parser.add_argument('--version', action='version', version='%(prog)s 1.0')
 
 parser.description = ('A simple client for tvheadend. You can query for channels or records '
@@ -64,9 +75,12 @@ parser.epilog = ('Examples:\n\n'
                  'tvhc -m hostname\n'
                  'Shows an overview of the tvheadend-server on host "hostname".\n\n'
                  
-                 'tvhc -q all -f json'
+                 'tvhc -q all -f json\n'
                  'Lists all records in json-format.\n\n'
 
+                 'tvhc -q all -f csv --columns id,startdate,title\n'
+                 'Lists id, start date and title of all records as csv.\n\n'
+
                  'tvhc -q "startdate:<-30d" -q "title:house"\n'
                  'Lists all records older than 30 days and with a title matching the regex-pattern "house".\n\n'
 
@@ -81,16 +95,6 @@ parser.epilog = ('Examples:\n\n'
 args = parser.parse_args()
 
 
-# define fieldtypes
-fieldtypes = {
-    'rec.id': int,
-    'rec.start': int,
-    'rec.stop': int,
-    'rec.duration': int,
-    'rec.startdate': datetime,
-}
-
-
 def print_overview(client):
     print("Machine:       %s:%s" % (host, port))
     print("Servername:    %s" % client.servername)
@@ -110,21 +114,10 @@ def parse_hostport(machine):
     
 
 
-def get_records(client):
-    result = client.records.copy()
-    for rec in result.values():
-        rec['channelname'] = client.channels[rec['channel']]['channelName']
-        rec['startdate'] = datetime.fromtimestamp(rec['start'])
-        rec['duration'] = rec['stop'] - rec['start']
-        rec['length'] = timedelta(seconds = rec['stop'] - rec['start'])
-
-    return sorted(result.values(), key=lambda rec: rec['start'])    
-
-    
-
 def get_channels(client):
-    result = client.channels.copy()
-    for chn in result.values():
+    # not via the store - a tvhcd client would fetch all records for it
+    result = sorted(client.channels.values(), key=lambda chn: (chn.get('channelNumber', 0), chn['channelId']))
+    for chn in result:
         chn['id'] = chn['channelId']
         
         if chn['services'] != None and len(chn['services']) > 0:
@@ -132,112 +125,18 @@ def get_channels(client):
         else:
             chn['type'] = "?"
 
-    return sorted(result.values(), key=lambda chn: chn['channelNumber'])
+    return result
 
     
 
-def get_items_of(client, type):
+def find_by_args(client, type, query):
+    # records are picked by the indexes of the store - or by tvhcd
     if type == 'rec':
-        return get_records(client)
+        return tvhclib.search_records(client, query)
     elif type == 'chn':
-        return get_channels(client)      
+        return tvhcquery.apply(tvhcquery.parse_query(query), get_channels(client), {})
     else:
         raise Exception("type %s is not supported." % type)
-    
-
-
-def get_int_match(value, pattern):
-    if pattern[0] == ">":
-        return value > int(pattern[1:])
-    elif pattern[0] == "<":
-        return value < int(pattern[1:])
-    else:
-        return value == int(pattern)
-
-   
-
-def repl_daterel(match):
-    timedeltas = {
-        'm': timedelta(seconds=60),
-        'h': timedelta(hours=1),
-        'd': timedelta(days=1),
-        'w': timedelta(weeks=1),
-        'y': timedelta(days=365)
-    }
-    
-    delta = timedeltas[match.group(2)]
-    count = int(match.group(1))
-    date = datetime.now() + delta * count
-    return date.strftime('%Y-%m-%d %H:%M:%S')
-    
-
-
-
-def get_date_match(value, pattern):
-    # replace relative definition to real date
-    pattern = re.sub(r'([+-]\d+)([mhdwy])', repl_daterel, pattern.lower())
-
-    if pattern[0] == ">":
-        date = datetime.strptime(pattern[1:], '%Y-%m-%d %H:%M:%S') 
-        return value > date
-    elif pattern[0] == "<":
-        date = datetime.strptime(pattern[1:], '%Y-%m-%d %H:%M:%S') 
-        return value < date
-    else:
-        date = datetime.strptime(pattern[1:], '%Y-%m-%d %H:%M:%S') 
-        return value == date
-
-    return False
-    
-
-
-def get_is_fieldmatch(item, type, field, pattern):
-    typekey = "%s.%s" % (type, field)
-    
-    if fieldtypes.get(typekey, None) == int:
-        return get_int_match(item[field], pattern)
-    
-    elif fieldtypes.get(typekey, None) == datetime:
-        return get_date_match(item[field], pattern)
-    
-    else:
-        match = re.search(pattern, item[field], re.IGNORECASE)
-        return match != None
-    
-    # fallback
-    return False 
-    
-
-
-def get_is_match(item, type, query):
-    if len(query) == 1 and query[0] == "all":
-        return True    
-    
-    for flt in query:
-        if not ':' in flt:
-            return False
-        
-        field, pattern = flt.split(':', 1)
-        if not get_is_fieldmatch(item, type, field, pattern):
-            return False
-
-    return True
-
-
-
-def find_by_args(client, type, query):
-    result = []
-    
-    if type == 'rec' and query[0] == "next":
-        result.append(get_next_record(client))
-    
-    items = get_items_of(client, type)
-    for item in items:
-        is_match = get_is_match(item, type, query)  
-        if is_match:
-            result.append(item)   
-    
-    return result
 
 
 
@@ -253,76 +152,40 @@ def get_print_format(args_format):
 
 
 
-def print_items(format, items, type):
-    for item in items:
-        try:
-            if format == 'json':
-                print(item)
-                print("")
-                
-            elif format == 'full':
-                keys = sorted(item.keys())
-                
-                if type == 'rec' and 'description' in keys:
-                    keys.remove('description')
-                    keys.append('description')
-                    
-                for key in keys:
-                    print('{0:<20}{1}'.format(key, item[key]))                    
-                print("")
-                
-            else:
-                print(format.format(**item))
-                
-        except KeyError:
-            print("KeyError in format. Available fields are: ")
-            for key in item:
-                print("  " + key)
-                
-            # abort
-            return False
-
-    # success
-    return True
+def print_items(format, items):
+    # buffered, machine readable formats are streamed
+    columns = tvhcoutput.parse_columns(args.columns)
+    proceed, count = tvhclib.print_items(items, format, columns=columns)
+    return proceed
 
 
 
 def delete_items(client, items, noconfirm, type):
     question = '\nDelete %s %s-items? Enter "yes" or "no": ' % (len(items), type)
     if noconfirm or input(question).lower() == 'yes':
-        if type == 'rec':        
-            for item in items:
-                x = client.delete_record(item['id'])
-                print("DEL ANSWER: %s" % x)
-        
-        print("%s items deleted." % len(items))
+        if type == 'rec':
+            results = client.delete_records([item['id'] for item in items], progress=print_progress)
+            failed = len([result for result in results if not result.ok])
+            print("%s items deleted, %s failed." % (len(items) - failed, failed))
+        else:
+            print("%s items can't be deleted." % type)
     else:
         print("Abort - nothing deleted.")
 
 
 
 
-def get_next_record(client):
-    now = time.time()
-    records = get_records(client)
-    records = sorted(records, key=lambda rec: rec['start'])
-    for rec in records:
-        if float(rec['start']) > now:
-            return rec
-
-    return None
-
-
 # get host and port
 host, port = parse_hostport(args.machine)
 
     
-# create client and open connection
-with HtspClient() as client:
-    if not client.open(host, port):
-        print('could not connect to "%s:%s" - Giving up.' % (host, port))
-        sys.exit(1)
+# open connection, via tvhcd if running
+client = tvhclib.open_client(args, host, int(port))
+if client == None:
+    print('could not connect to "%s:%s" - Giving up.' % (host, port))
+    sys.exit(1)
 
+with client:
     # print overview, if no search arguments
     if args.query == None:
         print_overview(client)    
@@ -336,7 +199,7 @@ with HtspClient() as client:
         format = get_print_format(args.format)
                 
         # print items
-        proceed = print_items(format, items, args.type)
+        proceed = print_items(format, items)
         
         # should items be deleted?
         if len(items) > 0 and proceed and args.delete:
@@ -1,13 +1,29 @@
 #!/usr/bin/env python
 
-from tvhc.htspsocket import HtspSocket
+try:
+    from tvhc.htspsocket import HtspSocket
+except ImportError:
+    # asyncore is gone since python 3.12. HtspClient needs it, the
+    # asyncio client, the protocol and the messages don't.
+    HtspSocket = None
+
 from tvhc.htspprotocol import HtspProtocol
 from tvhc.htspclient import HtspClient
+from tvhc.htspmessage import HtspMessage
+from tvhc.htspasync import HtspAsyncProtocol, AsyncHtspClient
+from tvhc.htsppool import HtspClientPool
 
 __all__ = [
     'htspsocket', 'HtspSocket',
     'htspprotocol', 'HtspProtocol',
     'htspclient', 'HtspClient',
+    'htspmessage', 'HtspMessage',
+    'htspasync', 'HtspAsyncProtocol', 'AsyncHtspClient',
+    'htsppool', 'HtspClientPool',
     'tvhclib']
 
+if HtspSocket == None:
+    __all__.remove('htspsocket')
+    __all__.remove('HtspSocket')
+
 
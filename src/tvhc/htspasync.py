@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+
+import asyncio
+from .htspprotocol import HtspProtocol
+from .htspframe import HtspFrameDecoder
+from .htspmux import HtspRequestMux
+from .htspclient import HtspClient
+from .htspstate import HtspStateStore
+from .htspbulk import HtspBulk
+
+
+class HtspAsyncProtocol(asyncio.Protocol):
+
+    # asyncio counterpart of HtspSocket. Callback messages go to the
+    # received handler, replies resolve the futures of send_recv.
+
+    def __init__(self, received_handler=None, protocol=None, metrics=None):
+        self.protocol = protocol or HtspProtocol()
+        self.metrics = metrics
+        self.transport = None
+        self._decoder = HtspFrameDecoder()
+        self._mux = HtspRequestMux(lambda: asyncio.get_running_loop().create_future())
+        self._received_handler = received_handler or self.received
+
+
+    def set_received_handler(self, handler):
+        self._received_handler = handler
+
+
+    def received(self, message):
+        pass
+
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self._mux.fail_all(ConnectionError('connection lost'))
+
+
+    def data_received(self, data):
+        if self.metrics == None:
+            for frame in self._decoder.feed(data):
+                self.dispatch(self.protocol.deserialize(frame))
+            return
+
+        for frame in self._decoder.feed(data):
+            self.dispatch(self.metrics.decode(self.protocol, frame))
+
+        self.metrics.gauge('queue.pending', self._mux.pending())
+
+
+    def dispatch(self, data):
+        # callback message?
+        if 'method' in data and data['method'] in self.protocol.HTSP_CALLBACKS:
+            if self.metrics != None:
+                self.metrics.handle(self._received_handler, data)
+            else:
+                self._received_handler(data)
+        else:
+            self._mux.resolve(data)
+
+
+    def send(self, message):
+        if self.transport is None:
+            raise ConnectionError('not connected')
+
+        frame = self.protocol.serialize(message)
+        self.transport.write(frame)
+
+        if self.metrics != None:
+            self.metrics.sent(len(frame))
+
+
+    def send_recv(self, message):
+        future = self._mux.register(message)
+
+        try:
+            self.send(message)
+        except:
+            self._mux.discard(message)
+            raise
+
+        if self.metrics != None:
+            self.metrics.track_request(message, future, self._mux.pending())
+
+        return future
+
+
+    def discard(self, message):
+        self._mux.discard(message)
+
+
+    def pending(self):
+        return self._mux.pending()
+
+
+    @property
+    def connected(self):
+        return self.transport is not None
+
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+
+class AsyncHtspClient(HtspClient):
+
+    # HtspClient driven by an asyncio event loop. Requests are coroutines,
+    # the metadata handlers are shared with HtspClient.
+
+    def __init__(self, name='pyhtsp', epg=False, metrics=None):
+        self.name = name
+        self.epg_enabled = epg
+        self.metrics = metrics
+        self._socket = HtspAsyncProtocol(self._received, metrics=metrics)
+        self._initevent = asyncio.Event()
+        self._listeners = []
+        self.set_store(HtspStateStore())
+
+
+    async def try_open(self, host='localhost', user=None, passwd=None, port=9982, timeout=5):
+        try:
+            await self.open(host, user, passwd, port, timeout)
+            return True
+        except:
+            return False
+
+
+    async def open(self, host='localhost', user=None, passwd=None, port=9982, timeout=5):
+
+        # set member variables
+        self.host = host
+        self.port = port
+
+        # connect & init routine
+        loop = asyncio.get_running_loop()
+        await loop.create_connection(lambda: self._socket, host, port)
+        await self.hello()
+
+        self.check_access(await self.authenticate(user, passwd))
+        await self.enable_async_metadata()
+
+        # wait for init
+        try:
+            await asyncio.wait_for(self._initevent.wait(), timeout)
+        except asyncio.TimeoutError:
+            raise Exception("could not initialize :-(")
+
+
+    def initialSyncCompleted(self, msg):
+        self.store.end_sync()
+        self._initialized = True
+        self._initevent.set()
+
+
+    async def send_recv(self, method, args, timeout=5):
+        if not isinstance(args, dict):
+            args = {}
+
+        args['method'] = method
+        try:
+            return await asyncio.wait_for(self._socket.send_recv(args), timeout)
+        except asyncio.TimeoutError:
+            self._socket.discard(args)
+            raise
+
+
+    def send_request(self, method, args):
+        if not isinstance(args, dict):
+            args = {}
+
+        args['method'] = method
+        return self._socket.send_recv(args)
+
+
+    async def hello(self):
+        args = {
+            'htspversion': self._socket.protocol.HTSP_VERSION,
+            'clientname': self.get_clientname(),
+            'clientversion': self.get_version()
+        }
+        result = await self.send_recv('hello', args)
+
+        self._challenge = result['challenge']
+        self.servername = result['servername']
+        self.serverversion = result['serverversion']
+        self.capabilities = result['servercapability']
+        return result
+
+
+    async def bulk(self, method, requests, keys=None, max_inflight=32, rate=None, progress=None):
+        runner = HtspBulk(self.send_request, max_inflight, rate, progress, discard=self._socket.discard)
+        return await runner.run_async(method, requests, keys)
+
+
+    # authenticate, get_disk_space, get_sys_time, enable_async_metadata
+    # and delete_record are inherited - they return the awaitable of
+    # send_recv. So do delete_records and the other bulk operations.
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+import time
+import asyncio
+import collections
+from concurrent import futures
+
+
+# seconds to wait for the answer of one request
+BULK_TIMEOUT = 5
+
+
+class HtspBulkResult(object):
+
+    # outcome of one request of a bulk operation
+
+    __slots__ = ('key', 'reply', 'error')
+
+    def __init__(self, key, reply=None, error=None):
+        self.key = key
+        self.reply = reply
+        self.error = error
+
+
+    @property
+    def ok(self):
+        return self.error == None
+
+
+    def __repr__(self):
+        if self.ok:
+            return 'HtspBulkResult(%r, ok)' % (self.key,)
+        return 'HtspBulkResult(%r, %r)' % (self.key, self.error)
+
+
+
+class HtspBulk(object):
+
+    # Sends many requests of one method over a pipelined connection:
+    # at most max_inflight unanswered at a time, at most rate per second
+    # if given. Every request gets a HtspBulkResult, failures don't stop
+    # the rest. progress(done, total, result) is called per reply,
+    # discard(message) drops a request given up on from the connection.
+
+    def __init__(self, send_request, max_inflight=32, rate=None, progress=None, timeout=BULK_TIMEOUT, discard=None):
+        self.send_request = send_request
+        self.max_inflight = max(int(max_inflight), 1)
+        self.rate = rate
+        self.progress = progress
+        self.timeout = timeout
+        self.discard = discard
+
+
+    def run(self, method, requests, keys=None):
+        # requests: list of argument maps, keys: one per request (default: 'id')
+        requests = list(requests)
+        keys = list(keys) if keys != None else [args.get('id', None) for args in requests]
+
+        results = []
+        inflight = collections.deque()
+        interval = 1.0 / self.rate if self.rate else 0
+        next_send = time.time()
+
+        for key, args in zip(keys, requests):
+            if len(inflight) >= self.max_inflight:
+                results.append(self._collect(inflight.popleft(), len(results), len(requests)))
+
+            # report what is answered already, not only when inflight is full
+            while inflight and _is_done(inflight[0][2]):
+                results.append(self._collect(inflight.popleft(), len(results), len(requests)))
+
+            if interval:
+                delay = next_send - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                next_send = max(next_send, time.time()) + interval
+
+            message = dict(args)
+            try:
+                inflight.append((key, message, self.send_request(method, message)))
+            except Exception as e:
+                inflight.append((key, message, e))
+
+        while inflight:
+            results.append(self._collect(inflight.popleft(), len(results), len(requests)))
+
+        return results
+
+
+    async def run_async(self, method, requests, keys=None):
+        # run on the event loop, send_request returns awaitables
+        requests = list(requests)
+        keys = list(keys) if keys != None else [args.get('id', None) for args in requests]
+
+        results = []
+        inflight = collections.deque()
+        interval = 1.0 / self.rate if self.rate else 0
+        next_send = time.time()
+
+        for key, args in zip(keys, requests):
+            if len(inflight) >= self.max_inflight:
+                results.append(await self._collect_async(inflight.popleft(), len(results), len(requests)))
+
+            while inflight and inflight[0][2].done():
+                results.append(await self._collect_async(inflight.popleft(), len(results), len(requests)))
+
+            if interval:
+                delay = next_send - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                next_send = max(next_send, time.time()) + interval
+
+            message = dict(args)
+            inflight.append((key, message, asyncio.ensure_future(self.send_request(method, message))))
+
+        while inflight:
+            results.append(await self._collect_async(inflight.popleft(), len(results), len(requests)))
+
+        return results
+
+
+    def _collect(self, pending, done, total):
+        key, message, future = pending
+
+        if isinstance(future, Exception):
+            result = HtspBulkResult(key, error=str(future))
+
+        else:
+            try:
+                reply = future.result(self.timeout)
+                result = HtspBulkResult(key, reply, get_reply_error(reply))
+            except futures.TimeoutError:
+                future.cancel()
+                if self.discard != None:
+                    self.discard(message)
+                result = HtspBulkResult(key, error='no answer in %s seconds' % self.timeout)
+            except Exception as e:
+                result = HtspBulkResult(key, error=str(e) or type(e).__name__)
+
+        if self.progress != None:
+            self.progress(done + 1, total, result)
+
+        return result
+
+
+    async def _collect_async(self, pending, done, total):
+        key, message, future = pending
+
+        try:
+            reply = await asyncio.wait_for(future, self.timeout)
+            result = HtspBulkResult(key, reply, get_reply_error(reply))
+        except asyncio.TimeoutError:
+            if self.discard != None:
+                self.discard(message)
+            result = HtspBulkResult(key, error='no answer in %s seconds' % self.timeout)
+        except Exception as e:
+            result = HtspBulkResult(key, error=str(e) or type(e).__name__)
+
+        if self.progress != None:
+            self.progress(done + 1, total, result)
+
+        return result
+
+
+
+def _is_done(future):
+    # failed sends are kept as the exception
+    return isinstance(future, Exception) or future.done()
+
+
+
+def get_reply_error(reply):
+    # tvheadend answers failures with 'error' or 'success': 0
+    if reply == None:
+        return 'no answer'
+
+    if 'error' in reply:
+        return str(reply['error'])
+
+    if reply.get('success', 1) == 0:
+        return 'failed'
+
+    return None
+
+
+
+def print_progress(done, total, result):
+    # progress callback for the command line tools
+    if result.ok:
+        print("ID %s done (%s/%s)." % (result.key, done, total))
+    else:
+        print("ID %s failed: %s (%s/%s)." % (result.key, result.error, done, total))
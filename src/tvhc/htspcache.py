@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+import os
+import re
+import time
+from .htspprotocol import HtspProtocol
+
+
+class HtspCache(object):
+
+    # On-disk snapshot of channels, tags, records and (optionally) EPG
+    # events of one server. The snapshot is a single HTSP encoded map, one
+    # file per "host:port", bound to the servername reported by hello.
+    #
+    # On open, the snapshot is loaded into the client store and passed as
+    # lastUpdate to enableAsyncMetadata - so tvheadend sends only events
+    # changed since then. Channels, tags and records are sent anyway.
+    # Snapshots younger than max_age seconds are used without waiting for
+    # the sync, changes still come in the background.
+
+    VERSION = 1
+
+    def __init__(self, directory, max_age=0, events=True):
+        self.directory = directory
+        self.max_age = max_age
+        self.events = events
+        self.protocol = HtspProtocol()
+
+
+    def get_path(self, host, port):
+        name = re.sub(r'[^\w.-]', '_', '%s_%s' % (host, port))
+        return os.path.join(self.directory, name + '.htsp')
+
+
+    def load(self, client):
+        # fills the store of client, returns the snapshot header or None
+        path = self.get_path(client.host, client.port)
+
+        try:
+            with open(path, 'rb') as f:
+                snapshot = self.protocol.deserialize(f.read())
+        except Exception:
+            return None
+
+        if snapshot.get('version', None) != self.VERSION:
+            return None
+
+        if snapshot.get('servername', None) != getattr(client, 'servername', None):
+            return None
+
+        store = client.store
+        for channel in snapshot.get('channels', []):
+            store.add_channel(channel)
+
+        for tag in snapshot.get('tags', []):
+            store.add_tag(tag)
+
+        for record in snapshot.get('records', []):
+            store.add_record(record)
+
+        if self.events:
+            for event in snapshot.get('events', []):
+                store.epg.add(event)
+
+        # ended events are never deleted by the server
+        store.epg.remove_before(time.time())
+
+        return snapshot
+
+
+    def is_fresh(self, snapshot):
+        if not self.max_age or snapshot == None:
+            return False
+
+        return time.time() - snapshot['saved'] < self.max_age
+
+
+    def save(self, client, last_update=None):
+        store = client.store
+
+        # updates change the maps in place - copy them under the lock
+        with store._lock:
+            snapshot = {
+                'version': self.VERSION,
+                'servername': client.servername,
+                'saved': int(time.time()),
+                'lastUpdate': int(last_update if last_update != None else time.time()),
+                'channels': [dict(channel) for channel in store.channels.values()],
+                'tags': [dict(tag) for tag in store.tags.values()],
+                'records': [dict(record) for record in store.records.values()],
+            }
+
+        if self.events and len(store.epg) > 0:
+            events = store.epg.between()
+            snapshot['events'] = [_event_fields(event) for event in events]
+
+        # write aside and rename - never leave a half written snapshot
+        path = self.get_path(client.host, client.port)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        temp = path + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(self.protocol.serialize(snapshot)[4:])
+
+        os.replace(temp, path)
+        return path
+
+
+    def remove(self, host, port):
+        path = self.get_path(host, port)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+
+def _event_fields(event):
+    return dict((key, event[key]) for key in event.keys() if event[key] != None)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import struct
+import argparse
+import threading
+from .htspprotocol import HtspProtocol
+
+
+# Capture files hold the raw HTSP frames of a session, appended as they
+# pass HtspSocket:
+#   magic b'HTSPCAP1' once, then per frame
+#   timestamp (double), direction (byte, 0 in / 1 out), length (uint32)
+#   and the frame without its own length prefix.
+#
+# HtspReplayer feeds the incoming frames of a capture through the
+# protocol and the handlers of a client, at full speed or with the
+# recorded pacing, and tells how long decoding and handlers took.
+
+MAGIC = b'HTSPCAP1'
+
+IN = 0
+OUT = 1
+
+_RECORD = struct.Struct('>dBI')
+
+
+class HtspCapture(object):
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+
+    def write(self, direction, frame, timestamp=None):
+        timestamp = time.time() if timestamp == None else timestamp
+        with self._lock:
+            if self._file != None:
+                self._file.write(_RECORD.pack(timestamp, direction, len(frame)))
+                self._file.write(frame)
+
+
+    def flush(self):
+        with self._lock:
+            if self._file != None:
+                self._file.flush()
+
+
+    def close(self):
+        with self._lock:
+            if self._file != None:
+                self._file.close()
+                self._file = None
+
+
+
+def read_capture(path):
+    # (timestamp, direction, frame) of every frame
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise Exception('%s is no HTSP capture.' % path)
+
+        while True:
+            header = f.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+
+            timestamp, direction, length = _RECORD.unpack(header)
+            frame = f.read(length)
+            if len(frame) < length:
+                # cut off while writing
+                return
+
+            yield timestamp, direction, frame
+
+
+
+class HtspReplayer(object):
+
+    # client: gets the callbacks via its _received, like from HtspSocket.
+    # Replies and requests are decoded, but go nowhere.
+
+    def __init__(self, client=None, protocol=None):
+        self.client = client
+        self.protocol = protocol or HtspProtocol()
+        self.reset()
+
+
+    def reset(self):
+        self.frames = 0
+        self.bytes = 0
+        self.callbacks = 0
+        self.decode_time = 0.0
+        self.handler_time = 0.0
+        self.elapsed = 0.0
+        self.recorded = 0.0
+
+
+    def replay(self, path, realtime=False, speed=1.0, directions=(IN,)):
+        callbacks = self.protocol.HTSP_CALLBACKS
+        clock = time.perf_counter
+        started = clock()
+        first = None
+
+        for timestamp, direction, frame in read_capture(path):
+            if direction not in directions:
+                continue
+
+            if first == None:
+                first = timestamp
+            self.recorded = timestamp - first
+
+            # wait for the recorded point in time
+            if realtime:
+                delay = (timestamp - first) / speed - (clock() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+            self.frames += 1
+            self.bytes += len(frame)
+
+            begin = clock()
+            message = self.protocol.deserialize(frame)
+            decoded = clock()
+            self.decode_time += decoded - begin
+
+            if self.client != None and direction == IN and message.get('method', None) in callbacks:
+                self.client._received(message)
+                self.handler_time += clock() - decoded
+                self.callbacks += 1
+
+        self.elapsed = clock() - started
+        return self
+
+
+    def report(self):
+        return {'frames': self.frames,
+                'bytes': self.bytes,
+                'callbacks': self.callbacks,
+                'decode': self.decode_time,
+                'handlers': self.handler_time,
+                'elapsed': self.elapsed,
+                'recorded': self.recorded}
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Shows or replays HTSP captures.')
+    parser.add_argument('command', choices=['dump', 'replay'])
+    parser.add_argument('path')
+    parser.add_argument('--realtime', action='store_true', default=False,
+                        help='Replay: keep the recorded pacing.')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Replay: factor of the recorded pacing. Default is 1.0.')
+    parser.add_argument('--epg', action='store_true', default=False,
+                        help='Replay: keep EPG events in the client.')
+    args = parser.parse_args(argv)
+
+    if args.command == 'dump':
+        protocol = HtspProtocol()
+        first = None
+        try:
+            for timestamp, direction, frame in read_capture(args.path):
+                first = timestamp if first == None else first
+                message = protocol.deserialize(frame)
+                print('%10.4f %s %6s %s' % (timestamp - first, '<' if direction == IN else '>',
+                                            len(frame), message.get('method', message.get('seq', ''))))
+        except BrokenPipeError:
+            # output piped into head and the like
+            sys.stderr.close()
+        return 0
+
+    from .htspclient import HtspClient
+    client = HtspClient(epg=args.epg)
+    replayer = HtspReplayer(client).replay(args.path, args.realtime, args.speed)
+
+    report = replayer.report()
+    print('Frames:    %s (%s bytes, %s callbacks)' % (report['frames'], report['bytes'], report['callbacks']))
+    print('Recorded:  %.3f s' % report['recorded'])
+    print('Replayed:  %.3f s' % report['elapsed'])
+    print('Decoding:  %.3f s' % report['decode'])
+    print('Handlers:  %.3f s' % report['handlers'])
+    print('Records:   %s, channels: %s, events: %s' % (len(client.records), len(client.channels), len(client.epg)))
+    return 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
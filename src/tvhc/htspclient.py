@@ -4,6 +4,8 @@ import socket
 import threading
 import logging
 from tvhc import *
+from tvhc.htspstate import HtspStateStore
+from tvhc.htspbulk import HtspBulk
 
     
 class HtspClient(object):
@@ -15,31 +17,53 @@ class HtspClient(object):
     _challenge = b''    
     _initialized = False
     _socket = None
-    _initcv = threading.Condition()
+    _initcv = None
+    _listeners = ()
+    epg_enabled = False
+    cache = None
+    metrics = None
     
     
-    # data properties
-    records = {}    
-    channels = {}
-    tags = {}
+    # data properties - plain dicts, indexes are kept by the store
+    store = None
+    records = None
+    channels = None
+    tags = None
+    epg = None
         
     
-    def __init__(self, name='pyhtsp'):
+    def __init__(self, name='pyhtsp', epg=False, cache=None, capture=None, metrics=None):
         self.name = name
+        self.epg_enabled = epg
+        self.cache = cache
+        self.metrics = metrics
+        self._initcv = threading.Condition()
+        self._listeners = []
+        self.set_store(HtspStateStore())
+
+        if HtspSocket == None:
+            raise Exception('HtspClient needs asyncore (or pyasyncore on python 3.12+), use AsyncHtspClient instead.')
+
         self._socket = HtspSocket()
         self._socket.set_received_handler(self._received)
+
+        if capture != None:
+            self._socket.set_capture(capture)
+
+        if metrics != None:
+            self._socket.set_metrics(metrics)
         
 
 
-    def try_open(self, host='localhost', user=None, passwd=None, port=9982):
+    def try_open(self, host='localhost', user=None, passwd=None, port=9982, timeout=5):
         try:
-            self.open(host, user, passwd, port)
+            self.open(host, user, passwd, port, timeout)
             return True
         except:
             return False
     
     
-    def open(self, host='localhost', user=None, passwd=None, port=9982):
+    def open(self, host='localhost', user=None, passwd=None, port=9982, timeout=5):
 
         # set member variables
         self.host = host
@@ -49,16 +73,38 @@ class HtspClient(object):
         self._socket.open(host, port)
         self.hello()
             
-        self.authenticate(user, passwd)
-        self.enable_async_metadata()
+        self.check_access(self.authenticate(user, passwd))
+        
+        # start from the local snapshot, if any, and ask for changes
+        # since then only. A fresh one is used right away, the changes
+        # come in the background.
+        snapshot = None
+        if self.cache != None:
+            snapshot = self.cache.load(self)
+        
+        last_update = snapshot['lastUpdate'] if snapshot != None else None
+
+        if self.cache != None and self.cache.is_fresh(snapshot):
+            self.store.begin_sync()
+            self.enable_async_metadata(last_update=last_update)
+            self._initialized = True
+            return
+
+        sync_start = self.get_sys_time().get('time', None) if self.cache != None else None
+        
+        self.store.begin_sync()
+        self.enable_async_metadata(last_update=last_update)
         
         # wait for init
         with self._initcv:
             if not self._initialized:
-                self._initcv.wait(5)
+                self._initcv.wait(timeout)
                 if not self._initialized:
                     raise Exception("could not initialize :-(")
         
+        if self.cache != None:
+            self.cache.save(self, sync_start)
+        
 
     def _received(self, msg):
         mkey = 'method'        
@@ -70,44 +116,83 @@ class HtspClient(object):
             else:
                 logging.warning("method %s not found." % method)
 
+            # after the store has the change
+            for listener in list(self._listeners):
+                listener(method, msg)
+
         else:
             print("unkown message received: %s" % msg)
 
 
+    def add_listener(self, listener):
+        # listener(method, msg) is called for every server callback
+        self._listeners.append(listener)
+
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+
+    def set_store(self, store):
+        self.store = store
+        self.records = store.records
+        self.channels = store.channels
+        self.tags = store.tags
+        self.epg = store.epg
+
+
     def channelAdd(self, msg):
-        id = msg['channelId']
-        self.channels[id] = msg
+        self.store.add_channel(msg)
 
 
     def channelUpdate(self, msg):
-        id = msg['channelId']
-        self.channels[id] = msg
+        self.store.update_channel(msg)
+
+
+    def channelDelete(self, msg):
+        self.store.remove_channel(msg['channelId'])
     
     
     def dvrEntryAdd(self, msg):
-        id = msg['id']
-        self.records[id] = msg
+        self.store.add_record(msg)
+
 
+    def dvrEntryUpdate(self, msg):
+        self.store.update_record(msg)
 
 
     def dvrEntryDelete(self, msg):
-        id = msg['id']
-        if id in self.records:
-            del self.records[id]
+        self.store.remove_record(msg['id'])
         
 
     def tagAdd(self, msg):
-        id = msg['tagId']
-        self.tags[id] = msg
+        self.store.add_tag(msg)
 
 
     def tagUpdate(self, msg):
-        id = msg['tagId']
-        for k, v in msg.items():
-            self.tags[id][k] = v
+        self.store.update_tag(msg)
+
+
+    def tagDelete(self, msg):
+        self.store.remove_tag(msg['tagId'])
+
+
+    def eventAdd(self, msg):
+        self.epg.add(msg)
+
+
+    def eventUpdate(self, msg):
+        self.epg.update(msg)
+
+
+    def eventDelete(self, msg):
+        self.epg.remove(msg['eventId'])
 
 
     def initialSyncCompleted(self, msg):
+        self.store.end_sync()
+        
         with self._initcv:
             self._initialized = True
             self._initcv.notify()
@@ -131,6 +216,16 @@ class HtspClient(object):
         args['method'] = method
         return self._socket.send_recv(args)
     
+    
+    
+    def send_request(self, method, args):
+        # like send_recv, but returns a future instead of waiting
+        if not isinstance(args, dict):
+            args = {}
+    
+        args['method'] = method
+        return self._socket.send_request(args)
+    
 
 
     def hello(self):
@@ -154,9 +249,31 @@ class HtspClient(object):
             self._user = user
         
         if passwd:
-            self._passwd = self.protocol.htsp_digest(self._user, self._passwd, self._challenge)
+            self._passwd = passwd
+        
+        return self.send_recv('authenticate', self.get_auth_args())
+    
+    
+    
+    def check_access(self, reply):
+        # tvheadend answers a failed login with noaccess, not an error
+        if reply == None or reply.get('noaccess', 0):
+            raise Exception('access denied for user "%s"' % (self._user or ''))
+
+        return reply
+    
+    
+    
+    def get_auth_args(self):
+        args = {}
+        if self._user:
+            args['username'] = self._user
         
-        return self.send_recv('authenticate', {})
+        if self._passwd:
+            protocol = self._socket.protocol
+            args['digest'] = protocol.htsp_digest(self._user, self._passwd, self._challenge)
+        
+        return args
     
     
     
@@ -170,8 +287,17 @@ class HtspClient(object):
 
     
     
-    def enable_async_metadata(self):
-        return self.send_recv('enableAsyncMetadata', {})
+    def enable_async_metadata(self, epg=None, last_update=None):
+        epg = self.epg_enabled if epg == None else epg
+        
+        args = {}
+        if epg:
+            args['epg'] = 1
+        
+        if last_update != None:
+            args['lastUpdate'] = int(last_update)
+        
+        return self.send_recv('enableAsyncMetadata', args)
 
 
 
@@ -179,14 +305,60 @@ class HtspClient(object):
         return self.send_recv('deleteDvrEntry', {
             'id': recordId
         })
-        
+
+
+    def cancel_record(self, recordId):
+        return self.send_recv('cancelDvrEntry', {'id': recordId})
+
+
+    def stop_record(self, recordId):
+        return self.send_recv('stopDvrEntry', {'id': recordId})
+
+
+    def update_record(self, recordId, fields):
+        args = dict(fields)
+        args['id'] = recordId
+        return self.send_recv('updateDvrEntry', args)
+
+
+
+    # bulk operations - pipelined, see HtspBulk
+    # ===================================================
+
+    def bulk(self, method, requests, keys=None, max_inflight=32, rate=None, progress=None):
+        runner = HtspBulk(self.send_request, max_inflight, rate, progress, discard=self._socket.discard)
+        return runner.run(method, requests, keys)
+
+
+    def delete_records(self, ids, max_inflight=32, rate=None, progress=None):
+        requests = [{'id': id} for id in ids]
+        return self.bulk('deleteDvrEntry', requests, None, max_inflight, rate, progress)
+
+
+    def cancel_records(self, ids, max_inflight=32, rate=None, progress=None):
+        requests = [{'id': id} for id in ids]
+        return self.bulk('cancelDvrEntry', requests, None, max_inflight, rate, progress)
+
+
+    def stop_records(self, ids, max_inflight=32, rate=None, progress=None):
+        requests = [{'id': id} for id in ids]
+        return self.bulk('stopDvrEntry', requests, None, max_inflight, rate, progress)
+
+
+    def update_records(self, updates, max_inflight=32, rate=None, progress=None):
+        # updates: maps with 'id' and the fields to change
+        return self.bulk('updateDvrEntry', updates, None, max_inflight, rate, progress)
+
+
+    def is_connected(self):
+        return self._socket != None and bool(self._socket.connected)
+
 
     def close(self):
         if self._socket != None:
             self._socket.close()
         
-        self.records.clear()
-        self.channels.clear()
+        self.store.clear()
 
     
     # enter & exit for 'whith <type> as <var> syntax
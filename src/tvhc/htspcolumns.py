@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+import operator
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class HtspRecordColumns(object):
+
+    # Column view of records: id, start, stop, duration, channel and a
+    # state code per record, as NumPy arrays if available and as plain
+    # arrays otherwise. Masks select rows - with NumPy they are boolean
+    # arrays and every operation is vectorised, without they are lists
+    # of bools. The view is a snapshot, see HtspStateStore.columns().
+
+    fields = ('id', 'start', 'stop', 'duration', 'channel')
+
+    def __init__(self, records):
+        records = list(records)
+        self.states = sorted(set(r.get('state', None) for r in records if r.get('state', None) != None))
+        codes = dict((state, code) for code, state in enumerate(self.states))
+
+        self._columns = {}
+        self._columns['id'] = _column([r['id'] for r in records])
+        self._columns['start'] = _column([r.get('start', 0) for r in records])
+        self._columns['stop'] = _column([r.get('stop', 0) for r in records])
+        self._columns['channel'] = _column([r.get('channel', 0) for r in records])
+        self._columns['state'] = _column([codes.get(r.get('state', None), -1) for r in records])
+
+        if numpy != None:
+            self._columns['duration'] = self._columns['stop'] - self._columns['start']
+        else:
+            self._columns['duration'] = _column([r.get('stop', 0) - r.get('start', 0) for r in records])
+
+        self._size = len(records)
+
+
+    def __len__(self):
+        return self._size
+
+
+    def column(self, field):
+        return self._columns[field]
+
+
+    # masks
+    # ===================================================
+
+    def all(self):
+        if numpy != None:
+            return numpy.ones(self._size, dtype=bool)
+        return [True] * self._size
+
+
+    def none(self):
+        if numpy != None:
+            return numpy.zeros(self._size, dtype=bool)
+        return [False] * self._size
+
+
+    def compare(self, field, compare, bound):
+        # compare is operator.lt, gt, eq etc.
+        values = self._columns[field]
+        if numpy != None:
+            return compare(values, bound)
+        return [compare(value, bound) for value in values]
+
+
+    def between(self, field, lower=None, upper=None):
+        # both bounds inclusive, None for open
+        mask = self.all()
+        if lower != None:
+            mask = self.both(mask, self.compare(field, operator.ge, lower))
+        if upper != None:
+            mask = self.both(mask, self.compare(field, operator.le, upper))
+        return mask
+
+
+    def in_states(self, states):
+        codes = [self.states.index(state) for state in states if state in self.states]
+        values = self._columns['state']
+
+        if numpy != None:
+            return numpy.isin(values, codes)
+
+        codes = set(codes)
+        return [value in codes for value in values]
+
+
+    def both(self, mask, other):
+        if numpy != None:
+            return mask & other
+        return [a and b for a, b in zip(mask, other)]
+
+
+    def either(self, mask, other):
+        if numpy != None:
+            return mask | other
+        return [a or b for a, b in zip(mask, other)]
+
+
+    def invert(self, mask):
+        if numpy != None:
+            return ~mask
+        return [not a for a in mask]
+
+
+    def count(self, mask):
+        if numpy != None:
+            return int(numpy.count_nonzero(mask))
+        return sum(1 for a in mask if a)
+
+
+    def select(self, mask, field='id'):
+        # values of field in the rows of mask
+        values = self._columns[field]
+        if numpy != None:
+            return values[mask].tolist()
+        return [value for value, a in zip(values, mask) if a]
+
+
+    def total(self, mask, field):
+        values = self._columns[field]
+        if numpy != None:
+            return int(values[mask].sum())
+        return sum(value for value, a in zip(values, mask) if a)
+
+
+
+def _column(values):
+    if numpy != None:
+        return numpy.array(values, dtype=numpy.int64)
+    return array('q', values)
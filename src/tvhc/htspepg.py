@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+
+import time
+import bisect
+import threading
+from array import array
+from .htsptrigram import TrigramIndex, pattern_trigrams
+
+
+class HtspEvent(object):
+
+    # One EPG event, built from the columns of HtspEpgStore on request.
+    # Supports item access, so it can be used like a message dict.
+
+    __slots__ = ('eventId', 'channelId', 'start', 'stop', 'title',
+                 'subtitle', 'summary', 'description', 'contentType')
+
+
+    def __init__(self, **fields):
+        for key in self.__slots__:
+            setattr(self, key, fields.get(key, None))
+
+
+    def keys(self):
+        return self.__slots__
+
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+
+    def __repr__(self):
+        return repr(dict((key, getattr(self, key)) for key in self.__slots__))
+
+
+
+class HtspEpgStore(object):
+
+    # Compact EPG storage. Events are rows in array-backed columns,
+    # titles and subtitles are interned, descriptions kept as utf8 bytes.
+    # Per channel, rows are kept sorted by start for range and now/next
+    # queries. Deleted rows are reused. Titles and subtitles can be
+    # trigram indexed (enable_text_index), add "description" to
+    # search_fields to index that as well.
+
+    def __init__(self, descriptions=True, search_fields=('title', 'subtitle')):
+        self.descriptions = descriptions
+        self.search_fields = tuple(search_fields)
+        self.text = None
+        self.text_enabled = False
+        self._lock = threading.RLock()
+        self._reset()
+
+
+    def _reset(self):
+        self._rows = {}
+        self._free = []
+        self._strings = {}
+
+        # columns
+        self._ids = array('q')
+        self._channels = array('q')
+        self._starts = array('q')
+        self._stops = array('q')
+        self._content = array('l')
+        self._titles = []
+        self._subtitles = []
+        self._summaries = []
+        self._texts = []
+
+        # channel -> (sorted starts, rows)
+        self._by_channel = {}
+
+
+    def __len__(self):
+        return len(self._rows)
+
+
+    def __contains__(self, id):
+        return id in self._rows
+
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+            self.text = None
+
+
+    # modification
+    # ===================================================
+
+    def add(self, msg):
+        with self._lock:
+            id = msg['eventId']
+            if id in self._rows:
+                self.remove(id)
+
+            row = self._free.pop() if self._free else self._append_row()
+            self._rows[id] = row
+
+            self._ids[row] = id
+            self._channels[row] = msg.get('channelId', 0)
+            self._starts[row] = msg.get('start', 0)
+            self._stops[row] = msg.get('stop', 0)
+            self._content[row] = msg.get('contentType', -1)
+            self._titles[row] = self._intern(msg.get('title', None))
+            self._subtitles[row] = self._intern(msg.get('subtitle', None))
+            self._summaries[row] = self._encode(msg.get('summary', None))
+            self._texts[row] = self._encode(msg.get('description', None))
+
+            self._index(row)
+            if self.text != None:
+                self.text.add(id, msg)
+
+
+    def update(self, msg):
+        # updates may carry changed fields only
+        with self._lock:
+            event = self.get(msg['eventId'])
+            if event == None:
+                return self.add(msg)
+
+            fields = dict((key, event[key]) for key in event.keys() if event[key] != None)
+            fields.update(msg)
+            self.add(fields)
+
+
+    def remove(self, id):
+        with self._lock:
+            row = self._rows.pop(id, None)
+            if row == None:
+                return False
+
+            self._unindex(row)
+            if self.text != None:
+                self.text.remove(id, self._event(row))
+            self._release(self._titles[row])
+            self._release(self._subtitles[row])
+            self._titles[row] = None
+            self._subtitles[row] = None
+            self._summaries[row] = None
+            self._texts[row] = None
+            self._free.append(row)
+            return True
+
+
+    def remove_before(self, timestamp):
+        # drops everything that ended before timestamp
+        with self._lock:
+            ids = [id for id, row in self._rows.items() if self._stops[row] < timestamp]
+            for id in ids:
+                self.remove(id)
+
+            return len(ids)
+
+
+    def _append_row(self):
+        for column in (self._ids, self._channels, self._starts, self._stops, self._content):
+            column.append(0)
+
+        for column in (self._titles, self._subtitles, self._summaries, self._texts):
+            column.append(None)
+
+        return len(self._ids) - 1
+
+
+    def _intern(self, value):
+        # string -> [string, rows using it], dropped with the last row
+        if value == None:
+            return None
+
+        entry = self._strings.get(value, None)
+        if entry == None:
+            entry = self._strings[value] = [value, 0]
+
+        entry[1] += 1
+        return entry[0]
+
+
+    def _release(self, value):
+        if value == None:
+            return
+
+        entry = self._strings[value]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._strings[value]
+
+
+    def _encode(self, value):
+        if value == None or not self.descriptions:
+            return None
+        return value.encode('utf8')
+
+
+    def _index(self, row):
+        starts, rows = self._by_channel.setdefault(self._channels[row], (array('q'), array('q')))
+        index = bisect.bisect_right(starts, self._starts[row])
+        starts.insert(index, self._starts[row])
+        rows.insert(index, row)
+
+
+    def _unindex(self, row):
+        channel = self._channels[row]
+        starts, rows = self._by_channel[channel]
+
+        index = bisect.bisect_left(starts, self._starts[row])
+        while rows[index] != row:
+            index += 1
+
+        del starts[index]
+        del rows[index]
+        if not rows:
+            del self._by_channel[channel]
+
+
+    # queries
+    # ===================================================
+
+    def get(self, id):
+        with self._lock:
+            row = self._rows.get(id, None)
+            return self._event(row) if row != None else None
+
+
+    def _event(self, row):
+        summary = self._summaries[row]
+        description = self._texts[row]
+        content = self._content[row]
+
+        return HtspEvent(eventId=self._ids[row],
+                         channelId=self._channels[row],
+                         start=self._starts[row],
+                         stop=self._stops[row],
+                         title=self._titles[row],
+                         subtitle=self._subtitles[row],
+                         summary=summary.decode('utf8') if summary != None else None,
+                         description=description.decode('utf8') if description != None else None,
+                         contentType=content if content >= 0 else None)
+
+
+    def enable_text_index(self):
+        # built on the first search it can narrow, see HtspStateStore
+        self.text_enabled = True
+
+
+    def build_text_index(self):
+        with self._lock:
+            self.text_enabled = True
+            if self.text == None:
+                self.text = TrigramIndex(self.search_fields)
+                for id, row in self._rows.items():
+                    self.text.add(id, self._event(row))
+
+            return self.text
+
+
+    def matching(self, field, pattern):
+        # events possibly matching the regex, None if the index can't tell
+        if not self.text_enabled or not pattern_trigrams(pattern):
+            return None
+
+        with self._lock:
+            ids = self.build_text_index().candidates(field, pattern)
+            if ids == None:
+                return None
+
+            return [self._event(self._rows[id]) for id in ids]
+
+
+    def channels(self):
+        with self._lock:
+            return list(self._by_channel.keys())
+
+
+    def on_channel(self, channel, start=None, stop=None):
+        # events of channel running between start and stop, ordered by start
+        with self._lock:
+            entry = self._by_channel.get(channel, None)
+            if entry == None:
+                return []
+
+            starts, rows = entry
+            index = 0
+            if start != None:
+                # the event before start may still be running
+                index = max(bisect.bisect_right(starts, start) - 1, 0)
+
+            result = []
+            for index in range(index, len(rows)):
+                row = rows[index]
+                if stop != None and self._starts[row] >= stop:
+                    break
+
+                if start == None or self._stops[row] > start:
+                    result.append(self._event(row))
+
+            return result
+
+
+    def between(self, start=None, stop=None):
+        with self._lock:
+            result = []
+            for channel in self._by_channel:
+                result.extend(self.on_channel(channel, start, stop))
+
+            return result
+
+
+    def now_next(self, channel, now=None):
+        # (running event, following event) - each may be None
+        now = time.time() if now == None else now
+
+        with self._lock:
+            entry = self._by_channel.get(channel, None)
+            if entry == None:
+                return (None, None)
+
+            starts, rows = entry
+            index = bisect.bisect_right(starts, now)
+
+            current = None
+            if index > 0 and self._stops[rows[index - 1]] > now:
+                current = self._event(rows[index - 1])
+
+            following = self._event(rows[index]) if index < len(rows) else None
+            return (current, following)
+
+
+    def now_next_all(self, now=None):
+        now = time.time() if now == None else now
+
+        with self._lock:
+            return dict((channel, self.now_next(channel, now)) for channel in self._by_channel)
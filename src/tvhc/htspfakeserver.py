@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import random
+import socket
+import argparse
+import threading
+import socketserver
+from .htspprotocol import HtspProtocol
+
+
+# A stand-in for tvheadend speaking HTSP, to run the clients, benchmarks
+# and tests without a real server:
+#
+#   python -m tvhc.htspfakeserver --port 9982 --records 5000 --latency 0.01
+#
+# The dataset is synthetic and reproducible by seed. latency delays the
+# delivery of every reply like a round trip would, the next requests are
+# read and handled meanwhile. fragment splits every write into chunks of
+# that many bytes and burst sends the metadata of enableAsyncMetadata in
+# writes of that many messages, with burst_pause seconds in between.
+
+
+class HtspFakeServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, dataset=None, latency=0, fragment=None,
+                 burst=None, burst_pause=0, user=None, passwd=None):
+        self.dataset = dataset if dataset != None else HtspFakeDataset()
+        self.latency = latency
+        self.fragment = fragment
+        self.burst = burst
+        self.burst_pause = burst_pause
+        self.user = user
+        self.passwd = passwd
+        self.protocol = HtspProtocol()
+        self._thread = None
+
+        socketserver.TCPServer.__init__(self, (host, port), HtspFakeHandler)
+
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+    def start(self):
+        # serve in a background thread
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+
+    def stop(self):
+        if self._thread != None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+
+        self.server_close()
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+
+
+class HtspFakeHandler(socketserver.BaseRequestHandler):
+
+    def setup(self):
+        self.server.dataset.connections.add(self)
+        self.protocol = self.server.protocol
+        self.challenge = os.urandom(32)
+        self.lock = threading.Lock()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+    def finish(self):
+        self.server.dataset.connections.discard(self)
+
+
+    def handle(self):
+        while True:
+            try:
+                request = self.protocol.recv(self.request)
+            except (EOFError, OSError):
+                return
+
+            method = request.get('method', None)
+            handler = getattr(self, 'htsp_%s' % method, None)
+
+            if handler == None:
+                reply = {'error': 'Method not found'}
+            else:
+                reply = handler(request)
+
+            if 'seq' in request:
+                reply['seq'] = request['seq']
+
+            if self.server.latency:
+                timer = threading.Timer(self.server.latency, self.deliver, (request, reply))
+                timer.daemon = True
+                timer.start()
+
+            elif not self.deliver(request, reply):
+                return
+
+
+    def deliver(self, request, reply):
+        try:
+            self.send([reply])
+            if request.get('method', None) == 'enableAsyncMetadata':
+                self.send_metadata(request)
+            return True
+        except OSError:
+            return False
+
+
+    def send(self, messages):
+        data = b''.join(bytes(self.protocol.serialize(message)) for message in messages)
+        chunk = self.server.fragment or len(data)
+
+        with self.lock:
+            for offset in range(0, len(data), chunk):
+                self.request.sendall(data[offset:offset + chunk])
+
+
+    def send_metadata(self, request):
+        dataset = self.server.dataset
+        messages = []
+
+        for channel in dataset.channels.values():
+            messages.append(dict(channel, method='channelAdd'))
+
+        for tag in dataset.tags.values():
+            messages.append(dict(tag, method='tagAdd'))
+
+        for record in dataset.records.values():
+            messages.append(dict(record, method='dvrEntryAdd'))
+
+        if request.get('epg', 0):
+            for event in dataset.events:
+                messages.append(dict(event, method='eventAdd'))
+
+        messages.append({'method': 'initialSyncCompleted'})
+
+        burst = self.server.burst or len(messages)
+        for offset in range(0, len(messages), burst):
+            self.send(messages[offset:offset + burst])
+            if self.server.burst_pause:
+                time.sleep(self.server.burst_pause)
+
+
+    # methods
+    # ===================================================
+
+    def htsp_hello(self, request):
+        return {'htspversion': self.protocol.HTSP_VERSION,
+                'servername': self.server.dataset.servername,
+                'serverversion': '4.2-fake',
+                'servercapability': ['timeshift'],
+                'challenge': self.challenge}
+
+
+    def htsp_authenticate(self, request):
+        server = self.server
+        if server.user == None:
+            return {}
+
+        digest = self.protocol.htsp_digest(server.user, server.passwd or '', self.challenge)
+        if request.get('username', None) != server.user or request.get('digest', None) != digest:
+            return {'noaccess': 1}
+
+        return {}
+
+
+    def htsp_enableAsyncMetadata(self, request):
+        return {}
+
+
+    def htsp_getDiskSpace(self, request):
+        dataset = self.server.dataset
+        return {'freediskspace': dataset.free, 'totaldiskspace': dataset.total}
+
+
+    def htsp_getSysTime(self, request):
+        return {'time': int(time.time()), 'timezone': 0, 'gmtoffset': 0}
+
+
+    def htsp_deleteDvrEntry(self, request):
+        return self.server.dataset.delete_record(request.get('id', None))
+
+
+    def htsp_cancelDvrEntry(self, request):
+        return self.server.dataset.update_record(request.get('id', None), {'state': 'completed'})
+
+
+    def htsp_stopDvrEntry(self, request):
+        return self.server.dataset.update_record(request.get('id', None), {'state': 'completed'})
+
+
+    def htsp_updateDvrEntry(self, request):
+        fields = dict((key, value) for key, value in request.items() if key not in ('method', 'seq', 'id'))
+        return self.server.dataset.update_record(request.get('id', None), fields)
+
+
+
+class HtspFakeDataset(object):
+
+    # Channels, tags, dvr entries and events of the fake server. Changes
+    # by requests are sent as callbacks to every connection.
+
+    states = ('completed', 'completed', 'scheduled', 'missed')
+
+    def __init__(self, channels=20, tags=5, records=1000, events=0, seed=0,
+                 description=200, servername='fake tvheadend', now=None):
+        now = int(time.time() if now == None else now)
+        rand = random.Random(seed)
+
+        self.servername = servername
+        self.connections = set()
+        self._lock = threading.Lock()
+
+        self.channels = {}
+        for id in range(1, channels + 1):
+            self.channels[id] = {'channelId': id,
+                                 'channelNumber': id,
+                                 'channelName': 'Channel %s' % id,
+                                 'eventId': 0,
+                                 'nextEventId': 0,
+                                 'tags': [1 + id % max(tags, 1)] if tags else [],
+                                 'services': [{'name': 'DVB-T/Mux %s/Channel %s' % (id % 8, id),
+                                               'type': 'HDTV' if id % 3 else 'SDTV'}]}
+
+        self.tags = {}
+        for id in range(1, tags + 1):
+            self.tags[id] = {'tagId': id,
+                             'tagName': 'Tag %s' % id,
+                             'members': [c for c in self.channels if 1 + c % tags == id]}
+
+        words = ('news', 'crime', 'sport', 'weather', 'house', 'doctor', 'travel', 'cooking',
+                 'music', 'film', 'series', 'documentary', 'nature', 'history', 'science')
+
+        def text(count):
+            return ' '.join(rand.choice(words) for _ in range(count))
+
+        self.records = {}
+        for id in range(1, records + 1):
+            # completed ones lie in the past, scheduled ones in the future
+            state = self.states[id % len(self.states)]
+            offset = rand.randint(1, 365 * 24) * 3600
+            start = now - offset if state != 'scheduled' else now + offset // 52
+            duration = rand.choice((1800, 2700, 3600, 5400))
+
+            self.records[id] = {'id': id,
+                                'channel': rand.randint(1, max(channels, 1)),
+                                'start': start,
+                                'stop': start + duration,
+                                'startExtra': 2,
+                                'stopExtra': 5,
+                                'title': '%s %s' % (text(2).title(), id % 97),
+                                'subtitle': text(3),
+                                'description': text(description // 8),
+                                'state': state,
+                                'dataSize': duration * 1000000 if state == 'completed' else 0,
+                                'playcount': 1 if id % 3 == 0 and state == 'completed' else 0}
+
+        self.events = []
+        eventId = 1
+        for channel in self.channels:
+            start = now - now % 3600
+            for _ in range(events // max(channels, 1)):
+                duration = rand.choice((900, 1800, 3600))
+                self.events.append({'eventId': eventId,
+                                    'channelId': channel,
+                                    'start': start,
+                                    'stop': start + duration,
+                                    'title': text(2).title(),
+                                    'summary': text(10),
+                                    'description': text(description // 8),
+                                    'contentType': rand.randint(1, 15) << 4})
+                eventId += 1
+                start += duration
+
+        self.total = 2 * sum(r['dataSize'] for r in self.records.values()) + (1 << 30)
+        self.free = self.total - sum(r['dataSize'] for r in self.records.values())
+
+
+    def delete_record(self, id):
+        with self._lock:
+            record = self.records.pop(id, None)
+            if record == None:
+                return {'success': 0, 'error': 'Entry not found'}
+
+            self.free += record.get('dataSize', 0)
+
+        self.broadcast({'method': 'dvrEntryDelete', 'id': id})
+        return {'success': 1}
+
+
+    def update_record(self, id, fields):
+        with self._lock:
+            record = self.records.get(id, None)
+            if record == None:
+                return {'success': 0, 'error': 'Entry not found'}
+
+            record.update(fields)
+
+        self.broadcast(dict(fields, method='dvrEntryUpdate', id=id))
+        return {'success': 1}
+
+
+    def broadcast(self, message):
+        for connection in list(self.connections):
+            try:
+                connection.send([message])
+            except OSError:
+                pass
+
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Fake tvheadend HTSP server with a synthetic dataset.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on. Default is "127.0.0.1".')
+    parser.add_argument('--port', type=int, default=9982, help='Port to listen on. Default is 9982.')
+    parser.add_argument('--channels', type=int, default=20, help='Count of channels. Default is 20.')
+    parser.add_argument('--tags', type=int, default=5, help='Count of tags. Default is 5.')
+    parser.add_argument('--records', type=int, default=1000, help='Count of dvr entries. Default is 1000.')
+    parser.add_argument('--events', type=int, default=0, help='Count of EPG events. Default is 0.')
+    parser.add_argument('--description', type=int, default=200, help='Length of descriptions. Default is 200.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the dataset. Default is 0.')
+    parser.add_argument('--latency', type=float, default=0, metavar='SECONDS', help='Delay of every reply.')
+    parser.add_argument('--fragment', type=int, default=None, metavar='BYTES', help='Write in chunks of BYTES.')
+    parser.add_argument('--burst', type=int, default=None, metavar='N', help='Send metadata in writes of N messages.')
+    parser.add_argument('--burst-pause', type=float, default=0, metavar='SECONDS', help='Pause between bursts.')
+    parser.add_argument('--user', default=None, help='Require this user.')
+    parser.add_argument('--passwd', default=None, help='Password of --user.')
+    return parser
+
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+
+    dataset = HtspFakeDataset(args.channels, args.tags, args.records, args.events,
+                              args.seed, args.description)
+    server = HtspFakeServer(args.host, args.port, dataset, args.latency, args.fragment,
+                            args.burst, args.burst_pause, args.user, args.passwd)
+
+    print('Serving %s records, %s events on %s:%s.' % (len(dataset.records), len(dataset.events),
+                                                      args.host, server.port))
+    sys.stdout.flush()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+
+if __name__ == '__main__':
+    main()
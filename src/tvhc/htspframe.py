@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+import struct
+
+
+_LENGTH = struct.Struct('>I')
+
+
+class HtspFrameDecoder(object):
+    
+    # size of a single read from the socket
+    chunk_size = 65536
+    
+    
+    def __init__(self, chunk_size=None):
+        if chunk_size:
+            self.chunk_size = chunk_size
+        
+        # reusable receive buffer and pending bytes of incomplete frames
+        self._chunk = bytearray(self.chunk_size)
+        self._chunk_view = memoryview(self._chunk)
+        self._pending = bytearray()
+    
+    
+    def read_from(self, sock):
+        # one syscall, any count of frames. None means connection closed.
+        count = sock.recv_into(self._chunk)
+        if count == 0:
+            return None
+        
+        return self.feed(self._chunk_view[:count])
+    
+    
+    def feed(self, data):
+        frames = []
+        
+        # fast path - nothing pending, take frames straight from data
+        if not self._pending:
+            offset = self._split(data, frames)
+            if offset < len(data):
+                self._pending += data[offset:]
+            return frames
+        
+        self._pending += data
+        with memoryview(self._pending) as view:
+            offset = self._split(view, frames)
+        
+        del self._pending[:offset]
+        return frames
+    
+    
+    def pending(self):
+        return len(self._pending)
+    
+    
+    def reset(self):
+        self._pending = bytearray()
+    
+    
+    def _split(self, data, frames):
+        offset = 0
+        size = len(data)
+        
+        while size - offset >= 4:
+            msglen = _LENGTH.unpack_from(data, offset)[0]
+            end = offset + 4 + msglen
+            if end > size:
+                break
+            
+            frames.append(bytes(data[offset + 4:end]))
+            offset = end
+        
+        return offset
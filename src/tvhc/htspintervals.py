@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+import bisect
+import threading
+
+
+class IntervalIndex(object):
+
+    # [start, stop) intervals by id, sorted by start. The longest interval
+    # bounds how far back an overlapping one may start, so a window query
+    # is a bisect plus a short scan. Load queries sweep over the start and
+    # stop points of the overlapping intervals only.
+    #
+    # key(id) groups intervals for the load: with a key, intervals of one
+    # group count once (like recordings sharing a mux share a tuner).
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._starts = []
+        self._durations = []
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def __contains__(self, id):
+        return id in self._entries
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            del self._starts[:]
+            del self._durations[:]
+
+
+    def add(self, id, start, stop):
+        with self._lock:
+            if id in self._entries:
+                self.remove(id)
+
+            stop = max(stop, start)
+            self._entries[id] = (start, stop)
+            bisect.insort(self._starts, (start, stop, id))
+            bisect.insort(self._durations, stop - start)
+
+
+    def remove(self, id):
+        with self._lock:
+            entry = self._entries.pop(id, None)
+            if entry == None:
+                return False
+
+            start, stop = entry
+            _remove_sorted(self._starts, (start, stop, id))
+            _remove_sorted(self._durations, stop - start)
+            return True
+
+
+    def get(self, id):
+        return self._entries.get(id, None)
+
+
+    def overlapping(self, start=None, stop=None):
+        # (start, stop, id) of intervals overlapping [start, stop), by start
+        with self._lock:
+            starts = self._starts
+            longest = self._durations[-1] if self._durations else 0
+
+            lower = 0 if start == None else bisect.bisect_left(starts, (start - longest,))
+            upper = len(starts) if stop == None else bisect.bisect_left(starts, (stop,))
+
+            return [entry for entry in starts[lower:upper] if start == None or entry[1] > start]
+
+
+    def load(self, start=None, stop=None):
+        # [(from, to, ids)] - the intervals active in each segment of the
+        # window, segments without any left out
+        entries = self.overlapping(start, stop)
+
+        points = []
+        for begin, end, id in entries:
+            begin = begin if start == None else max(begin, start)
+            end = end if stop == None else min(end, stop)
+            if begin < end:
+                points.append((begin, 1, id))
+                points.append((end, -1, id))
+
+        # at equal times stops come first - back to back doesn't overlap
+        points.sort(key=lambda point: (point[0], point[1]))
+
+        segments = []
+        active = {}
+        last = None
+
+        for time, change, id in points:
+            if last != None and time > last and active:
+                segments.append((last, time, list(active)))
+
+            if change > 0:
+                active[id] = True
+            else:
+                del active[id]
+
+            last = time
+
+        return segments
+
+
+    def concurrency(self, ids, key=None):
+        # count of intervals, or distinct groups with a key
+        if key == None:
+            return len(ids)
+        return len(set(key(id) for id in ids))
+
+
+    def max_concurrent(self, start=None, stop=None, key=None):
+        # (count, from, to) of the first peak, (0, None, None) if empty
+        best = (0, None, None)
+        for begin, end, ids in self.load(start, stop):
+            count = self.concurrency(ids, key)
+            if count > best[0]:
+                best = (count, begin, end)
+
+        return best
+
+
+    def conflicts(self, limit, start=None, stop=None, key=None):
+        # [(from, to, count, ids)] of segments needing more than limit,
+        # adjoining segments with the same ids merged
+        result = []
+        for begin, end, ids in self.load(start, stop):
+            count = self.concurrency(ids, key)
+            if count <= limit:
+                continue
+
+            if result and result[-1][1] == begin and set(result[-1][3]) == set(ids):
+                result[-1] = (result[-1][0], end, count, ids)
+            else:
+                result.append((begin, end, count, ids))
+
+        return result
+
+
+    def free_slots(self, limit, start, stop, key=None, min_length=0):
+        # [(from, to)] within the window with less than limit in use
+        slots = []
+        position = start
+
+        def free(begin, end):
+            if end - begin <= 0:
+                return
+            if slots and slots[-1][1] == begin:
+                slots[-1] = (slots[-1][0], end)
+            else:
+                slots.append((begin, end))
+
+        for begin, end, ids in self.load(start, stop):
+            free(position, begin)
+            if self.concurrency(ids, key) < limit:
+                free(begin, end)
+            position = end
+
+        free(position, stop)
+        return [slot for slot in slots if slot[1] - slot[0] >= min_length]
+
+
+
+def _remove_sorted(items, key):
+    index = bisect.bisect_left(items, key)
+    if index < len(items) and items[index] == key:
+        del items[index]
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+from collections.abc import MutableMapping
+
+
+class HtspMessage(MutableMapping):
+    
+    # A received HTSP map, decoded on demand. Field offsets are indexed
+    # on creation, values are decoded (and cached) on first access only.
+    
+    __slots__ = ('_protocol', '_view', '_fields', '_values')
+    
+    
+    def __init__(self, protocol, view, offset=0, end=None):
+        self._protocol = protocol
+        self._view = view
+        self._fields = {}
+        self._values = {}
+        
+        if end is None:
+            end = len(view)
+        
+        while offset < end:
+            header = protocol._read_header(view, offset, end)
+            data_type, name_start, data_start, data_end = header
+            
+            name = str(view[name_start:data_start], 'utf8')
+            self._fields[name] = (data_type, data_start, data_end)
+            offset = data_end
+    
+    
+    def __getitem__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        
+        data_type, data_start, data_end = self._fields[name]
+        value = self._protocol._decode_value(self._view, data_type, data_start, data_end)
+        self._values[name] = value
+        return value
+    
+    
+    def __setitem__(self, name, value):
+        if name not in self._fields:
+            self._fields[name] = None
+        
+        self._values[name] = value
+    
+    
+    def __delitem__(self, name):
+        del self._fields[name]
+        self._values.pop(name, None)
+    
+    
+    def __contains__(self, name):
+        return name in self._fields
+    
+    
+    def __iter__(self):
+        return iter(self._fields)
+    
+    
+    def __len__(self):
+        return len(self._fields)
+    
+    
+    def __repr__(self):
+        return repr(dict(self))
+    
+    
+    def copy(self):
+        # shares the frame, not yet decoded fields stay lazy
+        result = HtspMessage.__new__(HtspMessage)
+        result._protocol = self._protocol
+        result._view = self._view
+        result._fields = self._fields.copy()
+        result._values = self._values.copy()
+        return result
+    
+    
+    def decoded(self):
+        return len(self._values)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import bisect
+import threading
+
+
+# Instrumentation of a connection. HtspSocket and HtspAsyncProtocol
+# report to a HtspMetrics if one is set:
+#
+#   request.<method>   time from sending a request to its reply
+#   decode.<method>    deserialize time per message type ('reply' for replies)
+#   callback.<method>  time spent in the client handlers of a callback
+#   frames.in/out, bytes.in/out, requests.failed
+#   replies.dropped    replies nobody waits for anymore (HtspSocket)
+#   queue.pending      requests waiting for their reply
+#
+# Hooks get every single value as hook(kind, name, value), kind being
+# 'count', 'gauge' or 'observe' - to feed statsd, prometheus and the like.
+
+# histogram buckets: 1 microsecond doubling up to about a minute
+BOUNDS = [0.000001 * 2 ** i for i in range(27)]
+
+
+class HtspHistogram(object):
+
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(BOUNDS) + 1)
+
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min == None else min(self.min, value)
+        self.max = value if self.max == None else max(self.max, value)
+        self.buckets[bisect.bisect_left(BOUNDS, value)] += 1
+
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+    def percentile(self, percent):
+        # interpolated within the bucket holding it, so an estimate
+        if not self.count:
+            return None
+
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                lower = BOUNDS[index - 1] if index > 0 else 0.0
+                upper = BOUNDS[index] if index < len(BOUNDS) else self.max
+                value = lower + (upper - lower) * (rank - seen) / count
+                return min(max(value, self.min), self.max)
+            seen += count
+
+        return self.max
+
+
+    def fields(self):
+        return {'count': self.count,
+                'total': self.total,
+                'mean': self.mean,
+                'min': self.min,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'p99': self.percentile(99),
+                'max': self.max}
+
+
+
+class HtspMetrics(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hooks = []
+        self.reset()
+
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+
+
+    def add_hook(self, hook):
+        self._hooks.append(hook)
+
+
+    def remove_hook(self, hook):
+        if hook in self._hooks:
+            self._hooks.remove(hook)
+
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+        for hook in self._hooks:
+            hook('count', name, value)
+
+
+    def gauge(self, name, value):
+        # keeps the last and the highest value
+        with self._lock:
+            last, peak = self.gauges.get(name, (value, value))
+            self.gauges[name] = (value, max(peak, value))
+
+        for hook in self._hooks:
+            hook('gauge', name, value)
+
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self.histograms.get(name, None)
+            if histogram == None:
+                histogram = self.histograms[name] = HtspHistogram()
+            histogram.add(value)
+
+        for hook in self._hooks:
+            hook('observe', name, value)
+
+
+
+    # connection instrumentation
+    # ===================================================
+
+    def sent(self, size):
+        self.count('frames.out')
+        self.count('bytes.out', size)
+
+
+    def track_request(self, message, future, pending):
+        # observes the latency when the future of the request is done
+        name = 'request.%s' % message.get('method', None)
+        start = time.perf_counter()
+
+        def done(future):
+            if future.cancelled() or future.exception() != None:
+                self.count('requests.failed')
+            else:
+                self.observe(name, time.perf_counter() - start)
+
+        self.gauge('queue.pending', pending)
+        future.add_done_callback(done)
+
+
+    def decode(self, protocol, frame):
+        start = time.perf_counter()
+        message = protocol.deserialize(frame)
+        elapsed = time.perf_counter() - start
+
+        self.count('frames.in')
+        self.count('bytes.in', len(frame) + 4)
+        self.observe('decode.%s' % message.get('method', 'reply'), elapsed)
+        return message
+
+
+    def handle(self, handler, message):
+        # the handler may pop 'method'
+        name = 'callback.%s' % message.get('method', None)
+        start = time.perf_counter()
+        try:
+            return handler(message)
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+
+
+    # output
+    # ===================================================
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = time.time() - self.started
+            return {'elapsed': elapsed,
+                    'counters': dict(self.counters),
+                    'gauges': dict((name, {'last': last, 'max': peak})
+                                   for name, (last, peak) in self.gauges.items()),
+                    'histograms': dict((name, histogram.fields())
+                                       for name, histogram in self.histograms.items())}
+
+
+    def report(self, file=None):
+        file = file or sys.stderr
+        snapshot = self.snapshot()
+        elapsed = snapshot['elapsed'] or 1e-9
+
+        def ms(value):
+            return '%9.3f' % (value * 1000) if value != None else '%9s' % '-'
+
+        print('%-32s %7s %9s %9s %9s %9s %9s  (ms)' % ('Timing', 'count', 'total', 'mean', 'p50', 'p95', 'max'), file=file)
+        for name, fields in sorted(snapshot['histograms'].items()):
+            print('%-32s %7s %s %s %s %s %s' % (name, fields['count'], ms(fields['total']), ms(fields['mean']),
+                                                ms(fields['p50']), ms(fields['p95']), ms(fields['max'])), file=file)
+
+        print('%-32s %12s %12s' % ('Counter', 'total', 'per second'), file=file)
+        for name, value in sorted(snapshot['counters'].items()):
+            print('%-32s %12s %12.1f' % (name, value, value / elapsed), file=file)
+
+        print('%-32s %12s %12s' % ('Queue', 'last', 'max'), file=file)
+        for name, fields in sorted(snapshot['gauges'].items()):
+            print('%-32s %12s %12s' % (name, fields['last'], fields['max']), file=file)
+
+        file.flush()
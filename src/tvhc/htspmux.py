@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import itertools
+import threading
+import collections
+from concurrent.futures import Future
+
+
+class HtspRequestMux(object):
+
+    # Tags every request with a 'seq' number and keeps a future per
+    # pending request. tvheadend echoes 'seq' in its reply, so any count
+    # of requests may be outstanding on one connection.
+
+    def __init__(self, future_factory=Future):
+        self._future_factory = future_factory
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self._pending = collections.OrderedDict()
+
+
+    def register(self, message):
+        future = self._future_factory()
+
+        with self._lock:
+            seq = next(self._seq) & 0x7fffffff
+            self._pending[seq] = future
+
+        message['seq'] = seq
+        return future
+
+
+    def resolve(self, reply):
+        seq = reply.get('seq', None)
+
+        with self._lock:
+            if seq is not None:
+                future = self._pending.pop(seq, None)
+
+            # no seq given - replies come in order of the requests
+            elif self._pending:
+                future = self._pending.popitem(last=False)[1]
+
+            else:
+                future = None
+
+        if future is None:
+            return False
+
+        if not future.done():
+            future.set_result(reply)
+
+        return True
+
+
+    def discard(self, message):
+        with self._lock:
+            self._pending.pop(message.get('seq', None), None)
+
+
+    def fail_all(self, exc):
+        with self._lock:
+            futures = list(self._pending.values())
+            self._pending.clear()
+
+        for future in futures:
+            if not future.done():
+                future.set_exception(exc)
+
+
+    def pending(self):
+        return len(self._pending)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .htspclient import HtspClient
+
+
+class HtspClientPool(object):
+
+    # Keeps one HtspClient per tvheadend server. Every client has its own
+    # socket, loop thread and locks, so the servers never block each other.
+    # Clients are keyed by "host:port".
+
+    def __init__(self, name='pyhtsp'):
+        self.name = name
+        self._clients = {}
+        self._logins = {}
+        self._lock = threading.Lock()
+
+
+    def add(self, host='localhost', user=None, passwd=None, port=9982):
+        key = self.get_key(host, port)
+
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = HtspClient(self.name)
+                self._logins[key] = (host, user, passwd, int(port))
+
+        return key
+
+
+    def get_key(self, host, port=9982):
+        return '%s:%s' % (host, port)
+
+
+    def get(self, host, port=9982):
+        return self._clients[self.get_key(host, port)]
+
+
+    def clients(self):
+        with self._lock:
+            return dict(self._clients)
+
+
+    def open(self):
+        # connect and sync all servers in parallel, returns {key: success}
+        logins = dict(self._logins)
+        return self.map(lambda client, key: client.try_open(*logins[key]))
+
+
+    def map(self, func):
+        # calls func(client, key) for every client in parallel.
+        # returns {key: result}, exceptions are returned as result.
+        clients = self.clients()
+        if not clients:
+            return {}
+
+        with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+            futures = {key: executor.submit(func, client, key) for key, client in clients.items()}
+
+        result = {}
+        for key, future in futures.items():
+            exc = future.exception()
+            result[key] = exc if exc != None else future.result()
+
+        return result
+
+
+    def remove(self, host, port=9982):
+        key = self.get_key(host, port)
+
+        with self._lock:
+            client = self._clients.pop(key, None)
+            self._logins.pop(key, None)
+
+        if client != None:
+            client.close()
+
+
+    def close(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._logins.clear()
+
+        for client in clients:
+            client.close()
+
+
+    def __len__(self):
+        return len(self._clients)
+
+
+    # enter & exit for 'with <type> as <var> syntax
+    # ===================================================
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        self.close()
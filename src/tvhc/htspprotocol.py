@@ -2,6 +2,36 @@
 
 import struct
 import hashlib
+from collections.abc import Mapping
+from .htspmessage import HtspMessage
+
+
+# type (u8), name length (u8), data length (u32)
+_FIELD_HEADER = struct.Struct('>BBI')
+_LENGTH = struct.Struct('>I')
+
+
+# encoded field headers by (type, name) - field names repeat in every
+# message, so they are encoded only once.
+_prefix_cache = {}
+_prefix_cache_size = 1024
+
+
+def _field_prefix(fieldtype, name):
+    key = (fieldtype, name)
+    prefix = _prefix_cache.get(key)
+    
+    if prefix is None:
+        binary = name.encode('utf8')
+        if len(binary) > 255:
+            raise Exception('field name too long')
+        
+        prefix = _FIELD_HEADER.pack(fieldtype, len(binary), 0) + binary
+        if len(_prefix_cache) < _prefix_cache_size:
+            _prefix_cache[key] = prefix
+    
+    return prefix
+
 
 class HtspProtocol(object):
 
@@ -12,10 +42,48 @@ class HtspProtocol(object):
     HTSP_FIELD_STR = 3
     HTSP_FIELD_BIN = 4
     HTSP_FIELD_LST = 5
+    
+    # server initiated messages, everything else is a reply
+    HTSP_CALLBACKS = frozenset(['channelAdd',
+                                'channelUpdate',
+                                'channelDelete',
+                                'tagAdd',
+                                'tagUpdate',
+                                'tagDelete',
+                                'dvrEntryAdd',
+                                'dvrEntryUpdate',
+                                'dvrEntryDelete',
+                                'eventAdd',
+                                'eventUpdate',
+                                'eventDelete',
+                                'initialSyncCompleted',
+                                'subscriptionStart',
+                                'subscriptionStop',
+                                'subscriptionSkip',
+                                'subscriptionSpeed',
+                                'subscriptionStatus',
+                                'queueStatus',
+                                'signalStatus',
+                                'timeshiftStatus',
+                                'muxpkt'])
+    
+    # BIN fields are returned as bytes. Set to False to get memoryviews
+    # into the received frame instead (no copy, valid as long as the frame).
+    copy_bin = True
+    
+    # decode messages lazily on field access, see HtspMessage
+    lazy = False
+    
+    
+    def __init__(self, lazy=False):
+        self.lazy = lazy
 
 
 
     def htsp_digest(self, user, passwd, challenge):
+        if isinstance(passwd, str):
+            passwd = passwd.encode('utf8')
+        
         result = hashlib.sha1(passwd + challenge).digest()
         return result        
   
@@ -25,35 +93,35 @@ class HtspProtocol(object):
         if value < 0:
             return value.to_bytes(8, byteorder='little', signed=True)
         
+        if value >= 2**63:
+            raise Exception('value out of range')
         
-        for i in range(1,8):
-            if value < 2**(8*i):
-                return value.to_bytes(i, byteorder='little')    
+        # minimal count of bytes, zero is sent without any payload
+        return value.to_bytes((value.bit_length() + 7) // 8, byteorder='little')
     
     
     def s64_to_int(self, value):
-        return int.from_bytes(value, byteorder='little', signed=True)
+        # tvheadend sends the minimal count of bytes, only a full
+        # 8 byte value can carry the sign.
+        return int.from_bytes(value, byteorder='little', signed=len(value) == 8)
     
     
     
     def guess_fieldtype(self, value):
-        if type(value) == int:
+        if isinstance(value, int):
             return self.HTSP_FIELD_S64
         
-        elif type(value) == str:
-            return self.HTSP_FIELD_STR       
+        elif isinstance(value, str):
+            return self.HTSP_FIELD_STR
             
-        elif type(value) == bin:
-            raise Exception('invalid type')
+        elif isinstance(value, (bytes, bytearray, memoryview)):
             return self.HTSP_FIELD_BIN
         
-        elif type(value) == list:
-            raise Exception('invalid type')
-            return self.HTSP_FIELD_MAP
+        elif isinstance(value, (list, tuple)):
+            return self.HTSP_FIELD_LST
         
-        elif type(value) == dict:
-            raise Exception('invalid type')
-            return self.HTSP_FIELD_LIST
+        elif isinstance(value, Mapping):
+            return self.HTSP_FIELD_MAP
         
         else:
             raise Exception('invalid type')
@@ -61,100 +129,177 @@ class HtspProtocol(object):
     
     
     def serialize_value(self, value):
-        if type(value) == int:
-            return self.int_to_s64(value)
-    
-        if type(value) == str:
-            return value.encode('utf8')
-        
-        else:
-            raise Exception('invalid type')    
+        buffer = bytearray()
+        self._encode_value(buffer, self.guess_fieldtype(value), value)
+        return bytes(buffer)
     
     
     
     def serialize_field(self, name, value):
+        buffer = bytearray()
+        self._encode_field(buffer, name, value)
+        return bytes(buffer)
+    
+    
+    
+    def serialize(self, message):
+        # the whole frame is written into one bytearray, field lengths
+        # are patched in afterwards - so nesting costs no extra copies.
+        buffer = bytearray(4)
+        self._encode_fields(buffer, message.items())
+        _LENGTH.pack_into(buffer, 0, len(buffer) - 4)
+        return buffer
+    
+    
+    
+    def _encode_fields(self, buffer, items):
+        for name, value in items:
+            self._encode_field(buffer, name, value)
+    
+    
+    
+    def _encode_field(self, buffer, name, value):
         fieldtype = self.guess_fieldtype(value)
-        binary = self.serialize_value(value)
+        prefix = _field_prefix(fieldtype, name)
         
-        result = b''
-        result += struct.pack('>b', fieldtype)
-        result += struct.pack('>b', len(name))
-        result += struct.pack('>i', len(binary))
-        result += name.encode('utf8')
-        result += binary
-    
-        return result
+        offset = len(buffer)
+        buffer += prefix
+        self._encode_value(buffer, fieldtype, value)
+        _LENGTH.pack_into(buffer, offset + 2, len(buffer) - offset - len(prefix))
     
     
     
-    def serialize(self, message):
-        binary = b''
-        for key in message:
-            binary += self.serialize_field(key, message[key])
-            
-        result = struct.pack('>i', len(binary)) + binary
-        return result
+    def _encode_value(self, buffer, fieldtype, value):
+        if fieldtype == self.HTSP_FIELD_S64:
+            buffer += self.int_to_s64(value)
+        
+        elif fieldtype == self.HTSP_FIELD_STR:
+            buffer += value.encode('utf8')
+        
+        elif fieldtype == self.HTSP_FIELD_BIN:
+            buffer += value
+        
+        elif fieldtype == self.HTSP_FIELD_MAP:
+            self._encode_fields(buffer, value.items())
+        
+        elif fieldtype == self.HTSP_FIELD_LST:
+            for item in value:
+                self._encode_field(buffer, '', item)
+        
+        else:
+            raise Exception('invalid type')
     
     
     
     def recv(self, socket):
         # read header - it defines total count of chars to read
-        header = socket.recv(4)
-        msglen = struct.unpack('>i', header)[0]
+        header = self.recv_exact(socket, 4)
+        msglen = _LENGTH.unpack(header)[0]
         
         # read this amount of chars
-        message = socket.recv(msglen)
+        message = self.recv_exact(socket, msglen)
         
         # return    
         return self.deserialize(message)
     
     
     
+    def recv_exact(self, socket, count):
+        # tcp may hand out a frame in several pieces
+        result = bytearray(count)
+        view = memoryview(result)
+        offset = 0
+        
+        while offset < count:
+            received = socket.recv_into(view[offset:])
+            if received == 0:
+                raise EOFError('connection closed')
+            offset += received
+        
+        return result
+    
+    
+    
     def deserialize_field(self, message, offset):
-        data_type = struct.unpack_from('>b', message, offset + 0)[0]
-        name_len = struct.unpack_from('>b', message, offset + 1)[0]
-        data_len = struct.unpack_from('>i', message, offset + 2)[0]
+        view = message if isinstance(message, memoryview) else memoryview(message)
+        name, data, end = self._decode_field(view, offset, len(view), False)
+        return (name, data, end - offset)
+    
+    
+    
+    def deserialize(self, message, as_list = False):
+        # walk a single memoryview - nested maps and lists are decoded
+        # in place by offset, so the message is never sliced into copies.
+        view = message if isinstance(message, memoryview) else memoryview(message)
+        
+        if self.lazy and not as_list:
+            return HtspMessage(self, view, 0, len(view))
+        
+        return self._decode_fields(view, 0, len(view), as_list)
+    
+    
+    
+    def _decode_fields(self, view, offset, end, as_list):
+        result = {} if not as_list else []
+        
+        while offset < end:
+            name, data, offset = self._decode_field(view, offset, end, as_list)
+            
+            if as_list:
+                result.append(data)
+            else:
+                result[name] = data
+        
+        return result
+    
+    
+    
+    def _decode_field(self, view, offset, end, as_list):
+        data_type, name_start, data_start, data_end = self._read_header(view, offset, end)
+        
+        # list items are unnamed, no need to decode anything
+        name = None
+        if not as_list:
+            name = str(view[name_start:data_start], 'utf8')
+        
+        data = self._decode_value(view, data_type, data_start, data_end)
+        return (name, data, data_end)
+    
+    
+    
+    def _read_header(self, view, offset, end):
+        data_type, name_len, data_len = _FIELD_HEADER.unpack_from(view, offset)
         
         name_start = offset + 6
-        data_start = offset + 6 + name_len
+        data_start = name_start + name_len
+        data_end = data_start + data_len
         
-        name = message[name_start:name_start + name_len].decode("utf8")
-        data = message[data_start:data_start + data_len]
+        if data_end > end:
+            raise Exception('truncated field')
         
+        return (data_type, name_start, data_start, data_end)
+    
+    
+    
+    def _decode_value(self, view, data_type, data_start, data_end):
         if data_type == self.HTSP_FIELD_MAP:
-            data = self.deserialize(data, False)
+            if self.lazy:
+                return HtspMessage(self, view, data_start, data_end)
+            
+            return self._decode_fields(view, data_start, data_end, False)
     
         elif data_type == self.HTSP_FIELD_S64:
-            data = self.s64_to_int(data)
+            return self.s64_to_int(view[data_start:data_end])
     
         elif data_type == self.HTSP_FIELD_STR:
-            data = data.decode("utf8")
+            return str(view[data_start:data_end], 'utf8')
     
         elif data_type == self.HTSP_FIELD_BIN:
-            pass
+            data = view[data_start:data_end]
+            return data.tobytes() if self.copy_bin else data
     
         elif data_type == self.HTSP_FIELD_LST:
-            data = self.deserialize(data, True)
+            return self._decode_fields(view, data_start, data_end, True)
     
         else:
             raise Exception('invalid type')
-        
-        return (name, data, 6 + name_len + data_len)
-            
-            
-    
-    def deserialize(self, message, as_list = False):
-        result = {} if not as_list else []
-        offset = 0
-        
-        while offset < len(message):
-            field = self.deserialize_field(message, offset)
-            offset = offset + field[2]
-            
-            if as_list:
-                result.append(field[1])
-            else:
-                result[field[0]] = field[1]
-    
-        return result
-
@@ -5,25 +5,48 @@ import asyncore
 import socket
 import threading
 import time
+from concurrent import futures
 from .htspprotocol import HtspProtocol
-from .slock import SLock
+from .htspframe import HtspFrameDecoder
+from .htspmux import HtspRequestMux
+from .htspcapture import HtspCapture, IN, OUT
     
 class HtspSocket(asyncore.dispatcher):
 
     _received_handler = None
     
-    messages = None
     protocol = None
+    capture = None
+    metrics = None
     
     def __init__(self):
-        asyncore.dispatcher.__init__(self)
-        self.messages = []
+        # every connection runs its own loop over its own map, so
+        # connections never share a thread or a lock.
+        self._asyncore_map = {}
+        asyncore.dispatcher.__init__(self, map=self._asyncore_map)
         self.create_protocol()
+        self._decoder = HtspFrameDecoder()
+        self._mux = HtspRequestMux()
+        self._asyncore_buffer = bytearray()
+        self._asyncore_lock = threading.Lock()
         self._received_handler = self.received
     
     
     def set_received_handler(self, handler):
         self._received_handler = handler
+
+
+    def set_capture(self, capture):
+        # HtspCapture or a path - every frame in and out is appended
+        if isinstance(capture, str):
+            capture = HtspCapture(capture)
+
+        self.capture = capture
+
+
+    def set_metrics(self, metrics):
+        # HtspMetrics, see there for what is measured
+        self.metrics = metrics
     
     
     def create_protocol(self):
@@ -38,49 +61,84 @@ class HtspSocket(asyncore.dispatcher):
     
     def close(self):
         self._asyncore_stop()
+
+        if self.capture != None:
+            self.capture.close()
         
         
     def received(self, message):
         pass
     
     
-    _msg_condition = threading.Condition()
-    _send_lock1 = SLock(5.0)
-    _recv_lock1 = SLock(5.0)
+    def send_recv(self, message, timeout=5):
+        future = self.send_request(message)
+        
+        try:
+            return future.result(timeout)
+        except futures.TimeoutError:
+            self.discard(message)
+            raise RuntimeError("Did not receive any answer in %s seconds. Giving up." % timeout)
     
     
-    def send_recv(self, message):
-        # just wait for recv-actions ready...
-        with self._recv_lock1:
-            pass
+    def send_request(self, message):
+        # do not wait for the answer - the returned future gets it. 
+        # many requests may be in flight, replies are matched by seq.
+        future = self._mux.register(message)
+
+        try:
+            frame = self.protocol.serialize(message)
+        except:
+            self._mux.discard(message)
+            raise
+
+        if self.capture != None:
+            self.capture.write(OUT, bytes(frame[4:]))
+
+        if self.metrics != None:
+            self.metrics.sent(len(frame))
+            self.metrics.track_request(message, future, self._mux.pending())
         
-        # send data
-        cv = threading.Condition()
-        with self._send_lock1:
-            self._asyncore_buffer = self.protocol.serialize(message)
-            
-            with self._msg_condition:
-                while not self.messages:
-                    if not self._msg_condition.wait(5):
-                        raise RuntimeError("Did not receive any answer in 5 seconds. Giving up.")
+        with self._asyncore_lock:
+            self._asyncore_buffer += frame
+        
+        # try to send right away instead of waiting for the next poll
+        if self.connected:
+            self.handle_write()
         
-        return self.messages.pop(0)
+        return future
+    
+    
+    def discard(self, message):
+        # no more waiting for the reply of message
+        self._mux.discard(message)
+
+
+    def pending(self):
+        return self._mux.pending()
 
    
     
     # asyncore implementation
     # ===================================================
 
-    _asyncore_buffer = ''
     _asyncore_thread = None
     
     
     def _asyncore_run(self):
-        self._asyncore_thread = threading.Thread(target=asyncore.loop, kwargs = {'timeout':0.01})
-        self._asyncore_thread.setDaemon(True)
+        self._asyncore_thread = threading.Thread(target=self._asyncore_loop)
+        self._asyncore_thread.daemon = True
         self._asyncore_thread.start()
     
     
+    def _asyncore_loop(self):
+        try:
+            asyncore.loop(timeout=0.01, map=self._asyncore_map)
+        except OSError:
+            # socket got closed by another thread while polling
+            if self._asyncore_map:
+                raise
+    
+    
     def _asyncore_stop(self):
         super(HtspSocket, self).close()
     
@@ -96,55 +154,59 @@ class HtspSocket(asyncore.dispatcher):
 
 
     def handle_close(self):
-        pass
+        # nobody will answer pending requests anymore
+        self._mux.fail_all(ConnectionError('connection closed'))
+        self.close()
     
 
-    _srvcallbacks = ['channelAdd',
-                     'channelUpdate',
-                     'channelDelete',
-                     'tagAdd',
-                     'tagUpdate',
-                     'tagDelete',
-                     'dvrEntryAdd',
-                     'dvrEntryUpdate',
-                     'dvrEntryDelete',
-                     'eventAdd',
-                     'eventUpdate',
-                     'eventDelete',
-                     'initialSyncCompleted',
-                     'subscriptionStart',
-                     'subscriptionStop',
-                     'subscriptionSkip',
-                     'subscriptionSpeed',
-                     'subscriptionStatus',
-                     'queueStatus',
-                     'signalStatus',
-                     'timeshiftStatus',
-                     'muxpkt']
+    _srvcallbacks = HtspProtocol.HTSP_CALLBACKS
      
     
     def handle_read(self):
-        with self._recv_lock1:
-            data = self.protocol.recv(self)
-            
-            # callback message?
-            if 'method' in data and data['method'] in self._srvcallbacks:
-                self._received_handler(data)
+        # the loop thread of this connection is the only reader, no lock.
+        # one read may carry many frames - or just a part of one.
+        frames = self._decoder.read_from(self.socket)
+        if frames is None:
+            self.handle_close()
+            return
+        
+        if self.capture != None:
+            for frame in frames:
+                self.capture.write(IN, frame)
+
+        if self.metrics == None:
+            for frame in frames:
+                self.dispatch(self.protocol.deserialize(frame))
+            return
+
+        for frame in frames:
+            self.dispatch(self.metrics.decode(self.protocol, frame))
+
+        self.metrics.gauge('queue.pending', self._mux.pending())
+    
+    
+    def dispatch(self, data):
+        # callback message?
+        if 'method' in data and data['method'] in self._srvcallbacks:
+            if self.metrics != None:
+                self.metrics.handle(self._received_handler, data)
             else:
-                with self._msg_condition:
-                    self.messages.append(data)
-                    self._msg_condition.notify_all()
-            
+                self._received_handler(data)
+        
+        # answer of a pending request? late ones are dropped
+        elif not self._mux.resolve(data) and self.metrics != None:
+            self.metrics.count('replies.dropped')
         
 
     def writable(self):
-        return self._asyncore_buffer and len(self._asyncore_buffer) > 0
+        return len(self._asyncore_buffer) > 0
 
 
     def handle_write(self):
-        #print("handle_write")
-        sent = super(HtspSocket, self).send(self._asyncore_buffer)
-        self._asyncore_buffer = self._asyncore_buffer[sent:]
+        with self._asyncore_lock:
+            if self._asyncore_buffer:
+                sent = super(HtspSocket, self).send(self._asyncore_buffer)
+                del self._asyncore_buffer[:sent]
             
 
         
\ No newline at end of file
@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+
+import time
+import bisect
+import threading
+from .htspepg import HtspEpgStore
+from .htsptrigram import TrigramIndex, pattern_trigrams
+from .htspcolumns import HtspRecordColumns
+from .htspintervals import IntervalIndex
+
+
+class HtspStateStore(object):
+
+    # Metadata of one connection (channels, tags, dvr entries) plus
+    # indexes, maintained incrementally by the HtspClient handlers:
+    #   records sorted by start, records by channel, records by state
+    #   and channels sorted by number.
+    # Titles, subtitles and descriptions can be trigram indexed for
+    # searches (enable_text_index), columns() gives a column view of the
+    # numeric fields for bulk work.
+    # Scheduled and running records are in an interval index, padding
+    # included, for tuner load and conflicts.
+    # EPG events live in their own compact store, see HtspEpgStore.
+
+    def __init__(self):
+        self.records = {}
+        self.channels = {}
+        self.tags = {}
+        self.epg = HtspEpgStore()
+        self.text = None
+        self.text_enabled = False
+        self.intervals = IntervalIndex()
+
+        self._lock = threading.RLock()
+        self._record_starts = []
+        self._records_by_channel = {}
+        self._records_by_state = {}
+        self._channel_numbers = []
+        self._unseen = None
+        self._columns = None
+
+
+    def clear(self):
+        with self._lock:
+            self.records.clear()
+            self.channels.clear()
+            self.tags.clear()
+            self.epg.clear()
+            self.text = None
+            self.intervals.clear()
+            del self._record_starts[:]
+            del self._channel_numbers[:]
+            self._records_by_channel.clear()
+            self._records_by_state.clear()
+            self._unseen = None
+            self._columns = None
+
+
+    def begin_sync(self):
+        # everything not sent again until end_sync is gone on the server
+        with self._lock:
+            self._unseen = (set(self.records), set(self.channels), set(self.tags))
+
+
+    def end_sync(self):
+        with self._lock:
+            if self._unseen == None:
+                return
+
+            records, channels, tags = self._unseen
+            self._unseen = None
+
+            for id in records:
+                self.remove_record(id)
+
+            for id in channels:
+                self.remove_channel(id)
+
+            for id in tags:
+                self.remove_tag(id)
+
+
+    def _seen(self, index, id):
+        if self._unseen != None:
+            self._unseen[index].discard(id)
+
+
+    # records
+    # ===================================================
+
+    def add_record(self, msg):
+        with self._lock:
+            id = msg['id']
+            self._seen(0, id)
+            if id in self.records:
+                self._unindex_record(self.records[id])
+
+            self.records[id] = msg
+            self._index_record(msg)
+
+
+    def update_record(self, msg):
+        # updates may carry changed fields only
+        with self._lock:
+            self._seen(0, msg['id'])
+            record = self.records.get(msg['id'], None)
+            if record == None:
+                return self.add_record(msg)
+
+            self._unindex_record(record)
+            record.update(msg)
+            self._index_record(record)
+
+
+    def remove_record(self, id):
+        with self._lock:
+            record = self.records.pop(id, None)
+            if record != None:
+                self._unindex_record(record)
+
+            return record
+
+
+    def _index_record(self, record):
+        id = record['id']
+        bisect.insort(self._record_starts, (record.get('start', 0), id))
+        self._records_by_channel.setdefault(record.get('channel', None), set()).add(id)
+        self._records_by_state.setdefault(record.get('state', None), set()).add(id)
+        if self.text != None:
+            self.text.add(id, record)
+        self._columns = None
+
+        if record.get('state', None) in ('scheduled', 'recording'):
+            start, stop = get_padded_interval(record)
+            self.intervals.add(id, start, stop)
+
+
+    def _unindex_record(self, record):
+        id = record['id']
+        _remove_sorted(self._record_starts, (record.get('start', 0), id))
+        _discard_bucket(self._records_by_channel, record.get('channel', None), id)
+        _discard_bucket(self._records_by_state, record.get('state', None), id)
+        if self.text != None:
+            self.text.remove(id, record)
+        self._columns = None
+        self.intervals.remove(id)
+
+
+    def records_sorted(self):
+        with self._lock:
+            return [self.records[id] for start, id in self._record_starts]
+
+
+    def records_between(self, start=None, stop=None):
+        # records with start <= record start < stop, ordered by start
+        with self._lock:
+            starts = self._record_starts
+            lower = 0 if start == None else bisect.bisect_left(starts, (start,))
+            upper = len(starts) if stop == None else bisect.bisect_left(starts, (stop,))
+            return [self.records[id] for _, id in starts[lower:upper]]
+
+
+    def count_between(self, start=None, stop=None):
+        with self._lock:
+            starts = self._record_starts
+            lower = 0 if start == None else bisect.bisect_left(starts, (start,))
+            upper = len(starts) if stop == None else bisect.bisect_left(starts, (stop,))
+            return max(upper - lower, 0)
+
+
+    def columns(self):
+        # built on demand, dropped on any record change
+        with self._lock:
+            if self._columns == None:
+                self._columns = HtspRecordColumns(self.records_sorted())
+            return self._columns
+
+
+    def enable_text_index(self):
+        # Tokenizing every record costs more than a sync itself, so the
+        # index is for long running clients only. It is built on the first
+        # search it can narrow and kept up to date from then on.
+        self.text_enabled = True
+
+
+    def text_candidates(self, field, pattern):
+        # ids possibly matching the regex, None if the index can't tell
+        if not self.text_enabled or not pattern_trigrams(pattern):
+            return None
+
+        with self._lock:
+            return self.build_text_index().candidates(field, pattern)
+
+
+    def build_text_index(self):
+        # right now instead of on the first search
+        with self._lock:
+            self.text_enabled = True
+            if self.text == None:
+                self.text = TrigramIndex()
+                for id, record in self.records.items():
+                    self.text.add(id, record)
+
+            return self.text
+
+
+    def records_matching(self, field, pattern):
+        # records possibly matching the regex, None if the index can't tell
+        with self._lock:
+            ids = self.text_candidates(field, pattern)
+            if ids == None:
+                return None
+
+            return [self.records[id] for id in ids]
+
+
+    def next_record(self, now=None):
+        now = time.time() if now == None else now
+
+        with self._lock:
+            starts = self._record_starts
+            index = bisect.bisect_right(starts, (now, float('inf')))
+            if index < len(starts):
+                return self.records[starts[index][1]]
+
+        return None
+
+
+    def records_on_channel(self, channel):
+        with self._lock:
+            ids = self._records_by_channel.get(channel, ())
+            return [self.records[id] for id in ids]
+
+
+    def count_on_channel(self, channel):
+        return len(self._records_by_channel.get(channel, ()))
+
+
+    def count_in_state(self, state):
+        return len(self._records_by_state.get(state, ()))
+
+
+    def records_in_state(self, state):
+        with self._lock:
+            ids = self._records_by_state.get(state, ())
+            return [self.records[id] for id in ids]
+
+
+    def record_states(self):
+        with self._lock:
+            return list(self._records_by_state.keys())
+
+
+    # channels
+    # ===================================================
+
+    def add_channel(self, msg):
+        with self._lock:
+            id = msg['channelId']
+            self._seen(1, id)
+            if id in self.channels:
+                self._unindex_channel(self.channels[id])
+
+            self.channels[id] = msg
+            self._index_channel(msg)
+
+
+    def update_channel(self, msg):
+        with self._lock:
+            self._seen(1, msg['channelId'])
+            channel = self.channels.get(msg['channelId'], None)
+            if channel == None:
+                return self.add_channel(msg)
+
+            self._unindex_channel(channel)
+            channel.update(msg)
+            self._index_channel(channel)
+
+
+    def remove_channel(self, id):
+        with self._lock:
+            channel = self.channels.pop(id, None)
+            if channel != None:
+                self._unindex_channel(channel)
+
+            return channel
+
+
+    def _index_channel(self, channel):
+        key = (channel.get('channelNumber', 0), channel['channelId'])
+        bisect.insort(self._channel_numbers, key)
+
+
+    def _unindex_channel(self, channel):
+        key = (channel.get('channelNumber', 0), channel['channelId'])
+        _remove_sorted(self._channel_numbers, key)
+
+
+    def channels_sorted(self):
+        with self._lock:
+            return [self.channels[id] for number, id in self._channel_numbers]
+
+
+    def channel_by_number(self, number):
+        with self._lock:
+            numbers = self._channel_numbers
+            index = bisect.bisect_left(numbers, (number,))
+            if index < len(numbers) and numbers[index][0] == number:
+                return self.channels[numbers[index][1]]
+
+        return None
+
+
+    # tags
+    # ===================================================
+
+    def add_tag(self, msg):
+        with self._lock:
+            self._seen(2, msg['tagId'])
+            self.tags[msg['tagId']] = msg
+
+
+    def update_tag(self, msg):
+        with self._lock:
+            self._seen(2, msg['tagId'])
+            tag = self.tags.get(msg['tagId'], None)
+            if tag == None:
+                self.tags[msg['tagId']] = msg
+            else:
+                tag.update(msg)
+
+
+    def remove_tag(self, id):
+        with self._lock:
+            return self.tags.pop(id, None)
+
+
+
+def get_padded_interval(record):
+    # startExtra and stopExtra are minutes
+    start = record.get('start', 0) - record.get('startExtra', 0) * 60
+    stop = record.get('stop', 0) + record.get('stopExtra', 0) * 60
+    return start, stop
+
+
+
+def _remove_sorted(items, key):
+    index = bisect.bisect_left(items, key)
+    if index < len(items) and items[index] == key:
+        del items[index]
+
+
+def _discard_bucket(buckets, key, id):
+    bucket = buckets.get(key, None)
+    if bucket != None:
+        bucket.discard(id)
+        if not bucket:
+            del buckets[key]
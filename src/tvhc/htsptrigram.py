@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+import re
+import threading
+
+
+# re.IGNORECASE matches these with ascii letters, lower() doesn't fold them
+FOLD = str.maketrans({'\u0130': 'i', '\u0131': 'i', '\u017f': 's', '\u212a': 'k'})
+
+
+class TrigramIndex(object):
+
+    # Inverted index of folded trigrams per text field. candidates()
+    # narrows a regex search down to the items containing every trigram
+    # the pattern requires - the regex still has to be checked on those.
+    # Patterns narrow by their ascii trigrams only, folding of other
+    # characters differs between lower() and re.IGNORECASE.
+
+    def __init__(self, fields=('title', 'subtitle', 'description')):
+        self.fields = tuple(fields)
+        self._lock = threading.RLock()
+        self._postings = dict((field, {}) for field in self.fields)
+        self._count = 0
+
+
+    def __len__(self):
+        return self._count
+
+
+    def clear(self):
+        with self._lock:
+            for postings in self._postings.values():
+                postings.clear()
+            self._count = 0
+
+
+    def add(self, id, item):
+        with self._lock:
+            for field in self.fields:
+                postings = self._postings[field]
+                for gram in trigrams(item.get(field, None)):
+                    bucket = postings.get(gram, None)
+                    if bucket == None:
+                        postings[gram] = bucket = set()
+                    bucket.add(id)
+
+            self._count += 1
+
+
+    def remove(self, id, item):
+        # item has to carry the values it was added with
+        with self._lock:
+            for field in self.fields:
+                postings = self._postings[field]
+                for gram in trigrams(item.get(field, None)):
+                    bucket = postings.get(gram, None)
+                    if bucket != None:
+                        bucket.discard(id)
+                        if not bucket:
+                            del postings[gram]
+
+            self._count -= 1
+
+
+    def candidates(self, field, pattern):
+        # ids possibly matching pattern on field, None if no narrowing possible
+        if field not in self._postings:
+            return None
+
+        grams = pattern_trigrams(pattern)
+        if not grams:
+            return None
+
+        with self._lock:
+            postings = self._postings[field]
+            buckets = sorted((postings.get(gram, ()) for gram in grams), key=len)
+
+            result = set(buckets[0])
+            for bucket in buckets[1:]:
+                if not result:
+                    break
+                result.intersection_update(bucket)
+
+            return result
+
+
+
+def trigrams(text):
+    if not text or not isinstance(text, str):
+        return ()
+
+    text = text.translate(FOLD).lower()
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+
+def pattern_trigrams(pattern):
+    # trigrams every match of pattern contains, empty if none are known
+    grams = set()
+    for literal in required_literals(pattern):
+        grams.update(gram for gram in trigrams(literal) if gram.isascii())
+
+    return grams
+
+
+
+def required_literals(pattern):
+    # literal runs every match of pattern has to contain. Conservative:
+    # anything unclear ends a run, alternatives at top level give nothing.
+    # Verbose mode makes whitespace meaningless, so nothing is known then.
+    if re.search(r'\(\?[a-zA-Z]*x', pattern):
+        return []
+
+    literals = []
+    current = []
+    i = 0
+
+    def flush():
+        if len(current) >= 3:
+            literals.append(''.join(current))
+        del current[:]
+
+    while i < len(pattern):
+        c = pattern[i]
+
+        if c == '\\':
+            following = pattern[i + 1:i + 2]
+            if following and not following.isalnum():
+                current.append(following)
+                i += 2
+            else:
+                # classes, anchors, \x48, \u0048, \N{...}, octals and
+                # group references - their arguments are no literal text
+                flush()
+                i = skip_escape(pattern, i)
+            continue
+
+        elif c == '|':
+            return []
+
+        elif c in '([':
+            flush()
+            i = skip_group(pattern, i)
+            continue
+
+        elif c in '*?':
+            # last char is optional
+            if current:
+                current.pop()
+            flush()
+
+        elif c == '{':
+            if current:
+                current.pop()
+            flush()
+            end = pattern.find('}', i)
+            i = end + 1 if end >= 0 else len(pattern)
+            continue
+
+        elif c in '.^$+':
+            flush()
+
+        else:
+            current.append(c)
+
+        i += 1
+
+    flush()
+    return literals
+
+
+
+def skip_escape(pattern, i):
+    # index behind the escape starting at i
+    following = pattern[i + 1:i + 2]
+    end = i + 2
+
+    if following == 'x':
+        end += 2
+    elif following == 'u':
+        end += 4
+    elif following == 'U':
+        end += 8
+    elif following == 'N' and pattern[end:end + 1] == '{':
+        close = pattern.find('}', end)
+        end = close + 1 if close >= 0 else len(pattern)
+    elif following.isdigit():
+        while end < len(pattern) and end < i + 4 and pattern[end].isdigit():
+            end += 1
+
+    return min(end, len(pattern))
+
+
+
+def skip_group(pattern, i):
+    # index behind the group or character class starting at i
+    if pattern[i] == '[':
+        i += 1
+        if pattern[i:i + 1] == '^':
+            i += 1
+        if pattern[i:i + 1] == ']':
+            i += 1
+
+        while i < len(pattern) and pattern[i] != ']':
+            i += 2 if pattern[i] == '\\' else 1
+
+        return i + 1
+
+    depth = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 2
+            continue
+
+        elif c == '[':
+            i = skip_group(pattern, i)
+            continue
+
+        elif c == '(':
+            depth += 1
+
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+
+        i += 1
+
+    return i
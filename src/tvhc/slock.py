@@ -1,44 +1,28 @@
 #!/usr/bin/env python
 
-import sys
 import threading
 
 class SLock(object):
     
-    _condition = threading.Condition()
+    # reentrant lock with a default timeout. Waiting threads block on the
+    # lock itself - no polling.
+    
     _timeout = None
-    _locks = 0
-    _thread_id = 0 
     
     def __init__(self, timeout = None):
         self._timeout = timeout
-        self._locks = 0
-        pass        
+        self._lock = threading.RLock()
 
 
-    def acquire(self):
+    def acquire(self, timeout = None):
+        timeout = timeout if timeout != None else self._timeout
         
-        with self._condition:
-            tid = threading.current_thread().ident
-            
-            if self._locks > 0 and tid != self._thread_id:
-                self.waitfor()            
-            
-            self._thread_id = tid
-            self._locks += 1
-            
+        if not self._lock.acquire(timeout = -1 if timeout == None else timeout):
+            raise RuntimeError("lock timeout")
         
     
     def release(self):
-        self._locks -= 1
-        
-        if(self._locks < 0):
-            raise Exception("more releases than acquires??!")
-
-        if self._locks == 0:
-            with self._condition:
-                self._condition.notify()        
-        
+        self._lock.release()
     
     
     def __enter__(self):
@@ -48,16 +32,8 @@ class SLock(object):
     
     def __exit__(self, type, value, traceback):
         self.release()        
-        pass
     
     
     def waitfor(self, timeout = None):
-        timeout = timeout if timeout != None else self._timeout
-        
-        with self._condition:
-            while self._locks > 0:
-                self._condition.wait(timeout)
-                if self._locks > 0:
-                    print(self._locks)
-                    raise Exception("lock timeout")
-
+        self.acquire(timeout)
+        self.release()
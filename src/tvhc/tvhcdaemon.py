@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+
+import os
+import socket
+import threading
+import socketserver
+from concurrent.futures import Future
+from .htspprotocol import HtspProtocol
+from .htspstate import HtspStateStore
+from .htspbulk import HtspBulkResult, BULK_TIMEOUT
+
+
+class TvhcDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    # Serves the metadata of one synced HtspClient over a unix socket.
+    # Requests and replies are HTSP encoded maps, a request names its
+    # operation in 'op' - see the op_* methods.
+
+    daemon_threads = True
+
+    # ops sending partial replies before the final one
+    streaming = ('bulk',)
+
+    def __init__(self, client, path, mode=0o600):
+        self.client = client
+        self.path = path
+        self.protocol = HtspProtocol()
+
+        # remove stale socket of a previous run
+        if os.path.exists(path):
+            os.remove(path)
+
+        # bind with the final mode, a chmod afterwards leaves a window open
+        umask = os.umask(0o777 & ~mode)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, TvhcRequestHandler)
+        finally:
+            os.umask(umask)
+
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+    def dispatch(self, request, send=None):
+        op = request.get('op', None)
+        handler = getattr(self, 'op_%s' % op, None)
+
+        if handler == None:
+            return {'error': 'unknown op %s' % op}
+
+        try:
+            if op in self.streaming:
+                return handler(request, send)
+            return handler(request)
+        except Exception as e:
+            return {'error': str(e)}
+
+
+    def op_info(self, request):
+        client = self.client
+        return {'connected': int(client.is_connected()),
+                'host': client.host,
+                'port': int(client.port),
+                'servername': client.servername,
+                'serverversion': client.serverversion,
+                'servercapability': list(client.capabilities),
+                'channels': len(client.channels),
+                'records': len(client.records),
+                'tags': len(client.tags)}
+
+
+    def op_snapshot(self, request):
+        # records only if asked for, they are the bulk of it
+        store = self.client.store
+        snapshot = {'channels': list(store.channels.values()),
+                    'tags': list(store.tags.values())}
+
+        if request.get('records', 1):
+            snapshot['records'] = store.records_sorted()
+
+        return snapshot
+
+
+    def op_query(self, request):
+        from tvhc import tvhclib, tvhcquery
+
+        client = self.client
+        try:
+            found = tvhclib.search_records(client, request.get('query', None))
+        except tvhcquery.QueryError as e:
+            return {'queryerror': str(e)}
+
+        return {'records': [client.records[r['id']] for r in found]}
+
+
+    def op_next(self, request):
+        record = self.client.store.next_record(request.get('now', None))
+        return {'record': record} if record != None else {}
+
+
+    def op_request(self, request):
+        args = dict(request.get('args', {}))
+        return {'reply': self.client.send_recv(request['method'], args)}
+
+
+    def op_bulk(self, request, send=None):
+        # with 'stream', every result is sent as a partial reply once known
+        progress = None
+        if send != None and request.get('stream', 0):
+            def progress(done, total, result):
+                send({'partial': 1, 'done': done, 'total': total, 'result': _result_fields(result)})
+
+        results = self.client.bulk(request['method'],
+                                   request.get('requests', []),
+                                   request.get('keys', None),
+                                   request.get('maxinflight', 32),
+                                   request.get('ratemilli', 0) / 1000.0 or None,
+                                   progress)
+
+        if progress != None:
+            return {'done': len(results)}
+
+        return {'results': [_result_fields(result) for result in results]}
+
+
+
+class TvhcRequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        protocol = self.server.protocol
+
+        # one connection may send any count of requests
+        while True:
+            try:
+                request = protocol.recv(self.request)
+            except (EOFError, OSError):
+                return
+
+            reply = self.server.dispatch(request, self.send)
+            try:
+                self.request.sendall(protocol.serialize(reply))
+            except OSError:
+                return
+
+
+    def send(self, message):
+        # partial replies - a client gone meanwhile doesn't stop the op
+        try:
+            self.request.sendall(self.server.protocol.serialize(message))
+        except OSError:
+            pass
+
+
+
+class TvhcDaemonClient(object):
+
+    # Talks to a running tvhcd instead of tvheadend. Offers the parts of
+    # HtspClient the CLIs use. Searches and the next record are answered
+    # by the daemon, channels and tags are fetched on open. All records
+    # are fetched only if something asks for the store or the records.
+
+    def __init__(self, path):
+        self.path = path
+        self.protocol = HtspProtocol()
+        self._socket = None
+        self._lock = threading.Lock()
+        self._store = HtspStateStore()
+        self._records_loaded = False
+
+
+    @property
+    def store(self):
+        if not self._records_loaded:
+            self._records_loaded = True
+            for record in self.call('snapshot')['records']:
+                self._store.add_record(record)
+
+        return self._store
+
+
+    @property
+    def records(self):
+        return self.store.records
+
+
+    @property
+    def channels(self):
+        return self._store.channels
+
+
+    @property
+    def tags(self):
+        return self._store.tags
+
+
+    @property
+    def epg(self):
+        return self._store.epg
+
+
+    def try_open(self, host='localhost', user=None, passwd=None, port=9982, timeout=5):
+        try:
+            return self.open(host, user, passwd, port, timeout)
+        except (OSError, EOFError):
+            self.close()
+            return False
+
+
+    def open(self, host='localhost', user=None, passwd=None, port=9982, timeout=5):
+        self.timeout = timeout
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(self.path)
+
+        # the daemon must serve the requested server and be connected to it
+        info = self.call('info')
+        if (info['host'], info['port']) != (host, int(port)) or not info.get('connected', 1):
+            self.close()
+            return False
+
+        self.host = host
+        self.port = port
+        self.servername = info['servername']
+        self.serverversion = info['serverversion']
+        self.capabilities = info['servercapability']
+
+        snapshot = self.call('snapshot', records=0)
+        for channel in snapshot.get('channels', []):
+            self._store.add_channel(channel)
+
+        for tag in snapshot.get('tags', []):
+            self._store.add_tag(tag)
+
+        return True
+
+
+    def call(self, op, partial=None, **args):
+        # partial(reply) gets the partial replies of streaming ops
+        args['op'] = op
+
+        with self._lock:
+            self._socket.sendall(self.protocol.serialize(args))
+            reply = self.protocol.recv(self._socket)
+
+            while reply.get('partial', 0):
+                if partial != None:
+                    partial(reply)
+                reply = self.protocol.recv(self._socket)
+
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+
+        return reply
+
+
+    def send_recv(self, method, args):
+        return self.call('request', method=method, args=args or {})['reply']
+
+
+    def send_request(self, method, args):
+        future = Future()
+        future.set_result(self.send_recv(method, args))
+        return future
+
+
+    def search_records(self, query):
+        # found records, sorted and limited by the daemon
+        from tvhc import tvhcquery
+
+        reply = self.call('query', query=query or [])
+        if 'queryerror' in reply:
+            raise tvhcquery.QueryError(reply['queryerror'])
+
+        return reply['records']
+
+
+    def next_record(self, now=None):
+        args = {'now': int(now)} if now != None else {}
+        return self.call('next', **args).get('record', None)
+
+
+    def is_connected(self):
+        return self._socket != None
+
+
+    def get_disk_space(self):
+        return self.send_recv('getDiskSpace', {})
+
+
+    def get_sys_time(self):
+        return self.send_recv('getSysTime', {})
+
+
+    def delete_record(self, recordId):
+        return self.send_recv('deleteDvrEntry', {'id': recordId})
+
+
+    def bulk(self, method, requests, keys=None, max_inflight=32, rate=None, progress=None):
+        # runs in the daemon, which streams every result as it comes in
+        args = {'method': method, 'requests': list(requests), 'maxinflight': max_inflight, 'stream': 1}
+        if keys != None:
+            args['keys'] = list(keys)
+        if rate:
+            # HTSP knows no floats
+            args['ratemilli'] = int(rate * 1000)
+
+        results = []
+
+        def partial(reply):
+            result = reply['result']
+            results.append(HtspBulkResult(result.get('key', None), result.get('reply', None), result.get('error', None)))
+            if progress != None:
+                progress(reply['done'], reply['total'], results[-1])
+
+        # between two results the daemon may wait for an answer and the rate
+        interval = 1.0 / rate if rate else 0
+        self._socket.settimeout(self.timeout + BULK_TIMEOUT + interval)
+        try:
+            self.call('bulk', partial=partial, **args)
+        finally:
+            self._socket.settimeout(self.timeout)
+
+        return results
+
+
+    def delete_records(self, ids, max_inflight=32, rate=None, progress=None):
+        requests = [{'id': id} for id in ids]
+        return self.bulk('deleteDvrEntry', requests, None, max_inflight, rate, progress)
+
+
+    def cancel_records(self, ids, max_inflight=32, rate=None, progress=None):
+        requests = [{'id': id} for id in ids]
+        return self.bulk('cancelDvrEntry', requests, None, max_inflight, rate, progress)
+
+
+    def stop_records(self, ids, max_inflight=32, rate=None, progress=None):
+        requests = [{'id': id} for id in ids]
+        return self.bulk('stopDvrEntry', requests, None, max_inflight, rate, progress)
+
+
+    def update_records(self, updates, max_inflight=32, rate=None, progress=None):
+        return self.bulk('updateDvrEntry', updates, None, max_inflight, rate, progress)
+
+
+    def close(self):
+        if self._socket != None:
+            self._socket.close()
+            self._socket = None
+
+        self._store.clear()
+        self._records_loaded = False
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+
+def _result_fields(result):
+    fields = {}
+    if result.key != None:
+        fields['key'] = result.key
+    if result.reply != None:
+        fields['reply'] = result.reply
+    if result.error != None:
+        fields['error'] = result.error
+    return fields
@@ -1,15 +1,25 @@
 #!/usr/bin/env python
 
+import os
 import re
 import sys
+import atexit
 import time
+import string
 import argparse
+from collections.abc import Mapping
 from datetime import datetime, timedelta
 from argparse import RawTextHelpFormatter
+from tvhc.htspclient import HtspClient
+from tvhc.htspcache import HtspCache
+from tvhc.htspmetrics import HtspMetrics
+from tvhc.tvhcdaemon import TvhcDaemonClient
+from tvhc import tvhcquery, tvhcoutput
 
 
 # define fieldtypes
 fieldtypes = {'record': {'id': int,
+                         'channel': int,
                          'start': int,
                          'stop': int,
                          'duration': int,
@@ -22,6 +32,10 @@ fieldtypes = {'record': {'id': int,
 formats = {'record': '{id:>6}: {startdate} {shortstate} {title} ({length})'}
 
 
+# socket of tvhcd.service, reachable by the group tvhc
+SYSTEM_SOCKET = '/run/tvhc/tvhcd.sock'
+
+
 # define short states
 shortstates = {'completed': '-',
                'scheduled': '+',
@@ -44,111 +58,122 @@ def ask_for_delete(count, type):
 
 
 
-def extend_record(client, record):
-    rec = record.copy()
-    rec['channelname'] = client.channels[rec['channel']]['channelName']
-    rec['startdate'] = datetime.fromtimestamp(rec['start'])
-    rec['duration'] = rec['stop'] - rec['start']
-    rec['length'] = timedelta(seconds=rec['stop'] - rec['start'])
-    rec['shortstate'] = shortstates.get(rec['state'], rec['state'])
-    return rec
+def get_channelname(client, rec):
+    return client.channels[rec['channel']]['channelName']
 
 
+# derived record fields, computed from the record on access
+derived = {'record': {'channelname': get_channelname,
+                      'startdate': lambda client, rec: datetime.fromtimestamp(rec['start']),
+                      'duration': lambda client, rec: rec['stop'] - rec['start'],
+                      'length': lambda client, rec: timedelta(seconds=rec['stop'] - rec['start']),
+                      'shortstate': lambda client, rec: shortstates.get(rec['state'], rec['state'])
+                      }
+           }
 
-def get_next_record(client, relatime=time.time()):
-    records = client.records.values()
-    records = sorted(records, key=lambda rec: rec['start'])
-    for rec in records:
-        if float(rec['start']) > time.time():
-            return rec
 
-    return None
 
+class RecordView(Mapping):
 
-def get_active_records(client):
-    records = client.records.values()
-    for rec in records:
-        if rec['state'] == 'recording':
-            yield rec
+    # Read-only record plus its derived fields. Nothing is copied, a
+    # derived field is computed on first access only - so printing
+    # "{id} {title}" never builds a datetime.
 
+    __slots__ = ('_client', '_record', '_cache')
 
-def search_items(items, fieldtypes, queries):
-    for item in items:
-        if queries == None or get_is_match(item, fieldtypes, queries):
-            yield item
+    def __init__(self, client, record):
+        self._client = client
+        self._record = record
+        self._cache = {}
 
 
+    def __getitem__(self, key):
+        fields = derived['record']
+        if key not in fields:
+            return self._record[key]
 
-def get_is_match(item, fieldtypes, queries):
-    if queries and queries[0] == "all":
-        return True
+        if key not in self._cache:
+            self._cache[key] = fields[key](self._client, self._record)
 
-    for query in queries:
-        if ':' not in query:
-            return False
+        return self._cache[key]
 
-        field, pattern = query.split(':', 1)
-        if not get_is_fieldmatch(item, fieldtypes, field, pattern):
-            return False
 
-    return True
+    def __iter__(self):
+        for key in self._record:
+            if key not in derived['record']:
+                yield key
 
+        for key in derived['record']:
+            yield key
 
 
-def get_is_fieldmatch(item, fieldtypes, field, pattern):
-    if fieldtypes.get(field, None) == int:
-        return get_int_match(item[field], pattern)
+    def __len__(self):
+        return len(set(self._record) | set(derived['record']))
 
-    elif fieldtypes.get(field, None) == datetime:
-        return get_date_match(item[field], pattern)
 
-    else:
-        match = re.search(pattern, item[field], re.IGNORECASE)
-        return match != None
+    def copy(self):
+        return dict(self)
 
 
+    def __repr__(self):
+        return repr(dict(self))
 
-def get_int_match(value, pattern):
-    if pattern[0] == ">":
-        return value > int(pattern[1:])
-    elif pattern[0] == "<":
-        return value < int(pattern[1:])
-    else:
-        return value == int(pattern)
 
 
+def get_mux(client, channel):
+    # "DVB-T/Mux 1/Channel" - the service name without its last part
+    services = client.channels.get(channel, {}).get('services', None)
+    if services:
+        name = services[0].get('name', '')
+        if '/' in name:
+            return name.rsplit('/', 1)[0]
 
-def repl_daterel(match):
-    timedeltas = {
-        'm': timedelta(seconds=60),
-        'h': timedelta(hours=1),
-        'd': timedelta(days=1),
-        'w': timedelta(weeks=1),
-        'y': timedelta(days=365)
-    }
+    return 'channel %s' % channel
 
-    delta = timedeltas[match.group(2)]
-    count = int(match.group(1))
-    date = datetime.now() + delta * count
-    return date.strftime('%Y-%m-%d %H:%M:%S')
 
 
+def extend_record(client, record):
+    return RecordView(client, record)
 
-def get_date_match(value, pattern):
-    # replace relative definition to real date
-    pattern = re.sub(r'([+-]\d+)([mhdwy])', repl_daterel, pattern.lower())
 
-    if pattern[0] == ">":
-        date = datetime.strptime(pattern[1:], '%Y-%m-%d %H:%M:%S')
-        return value > date
-    elif pattern[0] == "<":
-        date = datetime.strptime(pattern[1:], '%Y-%m-%d %H:%M:%S')
-        return value < date
-    else:
-        date = datetime.strptime(pattern[1:], '%Y-%m-%d %H:%M:%S')
-        return value == date
 
-    return False
+def get_next_record(client, relatime=None):
+    if isinstance(client, TvhcDaemonClient):
+        return client.next_record(relatime)
+
+    return client.store.next_record(relatime)
+
+
+def get_active_records(client):
+    return client.store.records_in_state('recording')
+
+
+def search_items(items, fieldtypes, queries):
+    # compile once, then it's comparisons only
+    query = tvhcquery.parse_query(queries)
+    return tvhcquery.apply(query, items, fieldtypes)
+
+
+
+def search_records(client, queries):
+    # like search_items, but picks candidates by the indexes of the store
+    if isinstance(client, TvhcDaemonClient):
+        # the daemon searches its own store, only the results travel
+        return [extend_record(client, record) for record in client.search_records(queries)]
+
+    query = tvhcquery.parse_query(queries)
+    extend = lambda record: extend_record(client, record)
+    return tvhcquery.search_records(query, client.store, fieldtypes['record'], extend)
+
+
+
+def get_is_match(item, fieldtypes, queries):
+    return tvhcquery.compile_query(queries, fieldtypes)(item)
+
+
+
+def get_is_fieldmatch(item, fieldtypes, field, pattern):
+    return tvhcquery.compile_term(field, pattern, fieldtypes)(item)
 
 
 
@@ -173,36 +198,80 @@ def query_wake_timestamp(persistent_file):
 
 
 
-def print_items(items, format):
+def get_format_fields(format):
+    # top level field names referenced by a format string
+    fields = []
+    for literal, field, spec, conversion in string.Formatter().parse(format):
+        if field:
+            name = re.split(r'[.\[]', field, 1)[0]
+            if name not in fields:
+                fields.append(name)
+
+    return fields
+
+
+
+def print_items(items, format, columns=None):
+    # json, jsonl, csv and htsp are streamed, see tvhcoutput
+    if format in tvhcoutput.writers:
+        count = tvhcoutput.write_items(items, format, columns=columns)
+        return count != None, count or 0
+
+    out = tvhcoutput.open_stdout()
+    text = tvhcoutput.text_writer(out)
+    try:
+        return write_formatted(items, format, text)
+
+    except BrokenPipeError:
+        return False, 0
+
+    finally:
+        try:
+            text.detach()
+            out.flush()
+        except (BrokenPipeError, ValueError):
+            # reader is gone (like head), don't complain on exit
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+
+def write_formatted(items, format, text):
+    fields = None
+    if format != 'full':
+        fields = get_format_fields(format)
+
     count = 0
     for item in items:
         count = count + 1
         try:
-            if format == 'json':
-                print(item)
-                print("")
-
-            elif format == 'full':
+            if format == 'full':
                 keys = sorted(item.keys())
 
+                # the long description reads best at the end
+                if 'description' in keys:
+                    keys.remove('description')
+                    keys.append('description')
+
                 for key in keys:
-                    print('{0:<20}{1}'.format(key, item[key]))
-                print("")
+                    text.write('{0:<20}{1}\n'.format(key, item[key]))
+                text.write('\n')
 
             else:
-                print(format.format(**item))
+                # computes the fields named by format only
+                text.write(format.format(**dict((field, item[field]) for field in fields)))
+                text.write('\n')
 
         except KeyError:
-            print("KeyError in format. Available fields are: ")
+            text.write("KeyError in format. Available fields are: \n")
             for key in item:
-                print("  " + key)
+                text.write("  " + key + '\n')
 
             # abort
             return False, count
 
     # no items?
     if count == 0:
-        print("No items to print out.")
+        text.write("No items to print out.\n")
 
     # success
     return True, count
@@ -221,18 +290,119 @@ def get_default_port():
 
 def parse_host(host):
     if ':' in host:
-        return host.split(':')[:2]
+        host, port = host.split(':')[:2]
+        return (host, int(port))
     else:
         return (host, get_default_port())
 
 
 
+def get_default_cache():
+    base = os.environ.get('XDG_CACHE_HOME', None) or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'tvhc')
+
+
+
+def create_client(args, **kwargs):
+    cache = None
+    if getattr(args, 'usecache', False):
+        cache = HtspCache(args.cache, max_age=args.cache_age)
+
+    capture = getattr(args, 'capture', None)
+    if capture:
+        kwargs['capture'] = capture
+
+    metrics = create_metrics(args)
+    if metrics != None:
+        kwargs['metrics'] = metrics
+
+    return HtspClient(cache=cache, **kwargs)
+
+
+
+def create_metrics(args):
+    # with --stats: measure the connection, report to stderr on exit
+    if not getattr(args, 'stats', False):
+        return None
+
+    metrics = HtspMetrics()
+    atexit.register(metrics.report, sys.stderr)
+    return metrics
+
+
+
+def get_default_socket():
+    base = os.environ.get('XDG_RUNTIME_DIR', None) or '/tmp'
+    return os.path.join(base, 'tvhcd-%s.sock' % os.getuid())
+
+
+
+def find_socket(path):
+    # a tvhcd of the user first, the one of tvhcd.service otherwise
+    if path and os.path.exists(path):
+        return path
+
+    if path == get_default_socket() and os.path.exists(SYSTEM_SOCKET):
+        return SYSTEM_SOCKET
+
+    return None
+
+
+
+def open_client(args, host, port):
+    # prefer a running tvhcd for this server, connect directly otherwise.
+    # A capture or stats need the connection to tvheadend itself.
+    path = find_socket(getattr(args, 'socket', None))
+    direct = getattr(args, 'capture', None) or getattr(args, 'stats', False)
+    if path and not args.nodaemon and not direct:
+        client = TvhcDaemonClient(path)
+        if client.try_open(host, port=port):
+            return client
+
+    client = create_client(args)
+    if client.try_open(host, port=port):
+        return client
+
+    client.close()
+    return None
+
+
+
+def add_client_arguments(parser):
+    # the options of open_client and create_client, shared by all scripts
+    parser.add_argument('--usecache', action='store_true', default=False,
+                        help='Keep a metadata snapshot and sync only EPG changes since then. Pays off with EPG data only.')
+
+    parser.add_argument('--cache', default=get_default_cache(), metavar='PATH',
+                        help='Directory for metadata snapshots of --usecache. Default is "%s".' % get_default_cache())
+
+    parser.add_argument('--cache-age', type=int, default=0, metavar='SECONDS',
+                        help='With --usecache, use a snapshot younger than this without waiting for a sync. '
+                             'Default is 0 (always wait).')
+
+    parser.add_argument('--socket', default=get_default_socket(), metavar='PATH',
+                        help='Socket of tvhcd, used if running. Default is "%s", '
+                             'falling back to "%s" of tvhcd.service.' % (get_default_socket(), SYSTEM_SOCKET))
+
+    parser.add_argument('--nodaemon', action='store_true', default=False,
+                        help='Always connect to tvheadend directly, even if tvhcd is running.')
+
+    parser.add_argument('--capture', default=None, metavar='PATH',
+                        help='Append all HTSP frames of the connection to PATH, see "python -m tvhc.htspcapture".')
+
+    parser.add_argument('--stats', action='store_true', default=False,
+                        help='Print request latencies, decode and callback times and traffic to stderr on exit.')
+
+
+
 def create_parser(extend=None):
     # Add host argument. This is always available.
     parser = argparse.ArgumentParser()
     parser.add_argument("host", default=get_default_host(), nargs="?",
                         help='Defines the host to connect with. Default is "%s".' % get_default_host())
 
+    add_client_arguments(parser)
+
     if extend != None:
         extend(parser)
 
@@ -254,11 +424,18 @@ def print_client_info(host, port, client):
 def append_default_arguments(parser):
     parser.add_argument('--query', '-q', type = str,
                         action = 'append',
-                        help = 'One or more queries like "field:value". String values are compared by regex. Use < for lower, > for greater and +/- for relative time deltas.')
+                        help = 'One or more queries like "field:value". String values are compared by regex. Use < for lower, > for greater, '
+                               'low..high for ranges and +/- for relative time deltas. Prefix "!" negates, "||" separates alternatives. '
+                               'Also "sort:field,-field", "limit:n", "next" and "all".')
 
     parser.add_argument('--format', '-f', type = str,
                         default = None,
-                        help = 'Defines print-format for found items. Format is described in python docs for string.format(). Available Templates are "full" or "json".')
+                        help = 'Defines print-format for found items. Format is described in python docs for string.format(). Available Templates are "full", '
+                               'or streamed "json", "jsonl", "csv" and "htsp" (binary).')
+
+    parser.add_argument('--columns', type = str,
+                        default = None,
+                        help = 'Comma separated fields for json, jsonl, csv and htsp output. Default are all fields of the first item.')
 
     parser.add_argument('--noconfirm', action='store_true',
                         default = False,
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+import io
+import os
+import sys
+import csv
+import json
+from collections.abc import Mapping
+from datetime import datetime, timedelta
+from .htspprotocol import HtspProtocol
+
+
+# Machine readable output of items (records, channels...), written from
+# any iterable through one large buffer - no print per item, no list of
+# all items in memory:
+#   json    one JSON array
+#   jsonl   one JSON object per line
+#   csv     header plus one row per item
+#   htsp    HTSP encoded maps, length prefixed like on the wire - a
+#           compact snapshot, readable by read_htsp.
+
+BUFFER_SIZE = 1 << 20
+
+
+def open_stdout(buffer_size=BUFFER_SIZE):
+    # binary writer on the stdout file descriptor, bypassing sys.stdout
+    sys.stdout.flush()
+    return io.open(sys.stdout.fileno(), 'wb', buffering=buffer_size, closefd=False)
+
+
+
+def text_writer(out):
+    return io.TextIOWrapper(out, encoding='utf-8', newline='', write_through=False)
+
+
+
+def get_fields(item, columns=None):
+    if columns:
+        return list(columns)
+    return list(item.keys())
+
+
+
+def parse_columns(text):
+    # "id,title, start" -> ['id', 'title', 'start']
+    if not text:
+        return None
+    return [column.strip() for column in text.split(',') if column.strip()]
+
+
+
+def project(item, fields):
+    return dict((field, item.get(field, None)) for field in fields)
+
+
+
+def to_json(value):
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    elif isinstance(value, timedelta):
+        return int(value.total_seconds())
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    elif isinstance(value, Mapping):
+        return dict(value)
+
+    raise TypeError('%s is not JSON serializable' % type(value).__name__)
+
+
+
+def to_htsp(value):
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    elif isinstance(value, timedelta):
+        return int(value.total_seconds())
+    elif isinstance(value, bool):
+        return int(value)
+    elif isinstance(value, float):
+        return int(value)
+    elif isinstance(value, Mapping):
+        return dict((key, to_htsp(v)) for key, v in value.items() if v != None)
+    elif isinstance(value, (list, tuple)):
+        return [to_htsp(v) for v in value if v != None]
+
+    return value
+
+
+
+def to_csv(value):
+    if value == None:
+        return ''
+    elif isinstance(value, datetime):
+        return value.isoformat(' ')
+    elif isinstance(value, timedelta):
+        return int(value.total_seconds())
+    elif isinstance(value, (list, tuple, Mapping)):
+        return json.dumps(value, default=to_json)
+
+    return value
+
+
+
+def write_jsonl(items, out, columns=None):
+    text = text_writer(out)
+    encode = json.JSONEncoder(default=to_json, ensure_ascii=False).encode
+    fields = None
+    count = 0
+
+    for item in items:
+        if fields == None:
+            fields = get_fields(item, columns)
+
+        text.write(encode(project(item, fields)))
+        text.write('\n')
+        count += 1
+
+    text.detach()
+    return count
+
+
+
+def write_json(items, out, columns=None):
+    text = text_writer(out)
+    encode = json.JSONEncoder(default=to_json, ensure_ascii=False).encode
+    fields = None
+    count = 0
+
+    text.write('[')
+    for item in items:
+        if fields == None:
+            fields = get_fields(item, columns)
+
+        text.write(',\n' if count else '\n')
+        text.write(encode(project(item, fields)))
+        count += 1
+
+    text.write('\n]\n' if count else ']\n')
+    text.detach()
+    return count
+
+
+
+def write_csv(items, out, columns=None):
+    text = text_writer(out)
+    writer = csv.writer(text)
+    fields = None
+    count = 0
+
+    for item in items:
+        if fields == None:
+            fields = get_fields(item, columns)
+            writer.writerow(fields)
+
+        writer.writerow([to_csv(item.get(field, None)) for field in fields])
+        count += 1
+
+    text.detach()
+    return count
+
+
+
+def write_htsp(items, out, columns=None):
+    serialize = HtspProtocol().serialize
+    fields = None
+    count = 0
+
+    for item in items:
+        if fields == None:
+            fields = get_fields(item, columns)
+
+        out.write(serialize(to_htsp(project(item, fields))))
+        count += 1
+
+    return count
+
+
+
+def read_htsp(stream):
+    # items written by write_htsp
+    protocol = HtspProtocol()
+    while True:
+        header = stream.read(4)
+        if len(header) < 4:
+            return
+
+        length = int.from_bytes(header, 'big')
+        yield protocol.deserialize(stream.read(length))
+
+
+
+writers = {'json': write_json,
+           'jsonl': write_jsonl,
+           'csv': write_csv,
+           'htsp': write_htsp}
+
+
+
+def write_items(items, format, out=None, columns=None):
+    # returns the count of written items
+    if out != None:
+        return writers[format](items, out, columns)
+
+    out = open_stdout()
+    try:
+        count = writers[format](items, out, columns)
+        out.flush()
+        return count
+
+    except BrokenPipeError:
+        # reader is gone (like head), don't complain on exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return None
@@ -0,0 +1,543 @@
+#!/usr/bin/env python
+
+import re
+import time
+import heapq
+import operator
+import itertools
+from datetime import datetime, timedelta
+
+
+# Queries like "field:pattern" are compiled once into predicates, so
+# matching an item is comparisons only - no splitting, regex compiling
+# or date parsing per item.
+#
+# Every query argument is a clause, all clauses have to match:
+#   field:pattern         regex for strings, =, < or > for numbers and dates
+#   field:low..high       range for numbers and dates, both inclusive
+#   !field:pattern        negation ("not field:pattern" works too)
+#   a:x || b:y            any of the alternatives
+#   sort:field,-field     sort order, "-" for descending
+#   limit:n               at most n items
+#   all                   no restriction
+#   next                  start in the future, first one only (by default)
+
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+comparisons = {'>': operator.gt,
+               '<': operator.lt,
+               '=': operator.eq}
+
+
+# below this many candidates a column mask isn't worth building
+COLUMNS_MIN = 512
+
+
+timedeltas = {'m': timedelta(seconds=60),
+              'h': timedelta(hours=1),
+              'd': timedelta(days=1),
+              'w': timedelta(weeks=1),
+              'y': timedelta(days=365)}
+
+
+class QueryError(ValueError):
+    pass
+
+
+
+class Term(object):
+
+    __slots__ = ('field', 'pattern', 'negate')
+
+    def __init__(self, field, pattern, negate=False):
+        self.field = field
+        self.pattern = pattern
+        self.negate = negate
+
+
+
+class Query(object):
+
+    # parsed form of the query arguments, see parse_query
+
+    def __init__(self):
+        self.clauses = []
+        self.sort = []
+        self.limit = None
+        self.after = None
+
+
+    def compile(self, fieldtypes):
+        predicates = []
+        for clause in self.clauses:
+            alternatives = [compile_term(t.field, t.pattern, fieldtypes, t.negate) for t in clause]
+            predicates.append(match_any(alternatives))
+
+        if self.after != None:
+            predicates.append(compare_field('start', operator.gt, self.after))
+
+        return match_every(predicates) if predicates else match_all
+
+
+    def single_terms(self):
+        # positive terms, that have to match on their own
+        for clause in self.clauses:
+            if len(clause) == 1 and not clause[0].negate:
+                yield clause[0]
+
+
+
+def parse_query(queries, now=None):
+    query = Query()
+
+    for text in queries or []:
+        text = text.strip()
+
+        if text == 'all':
+            continue
+
+        elif text == 'next':
+            query.after = int(time.time() if now == None else now)
+
+        elif text.startswith('sort:'):
+            for key in text[5:].split(','):
+                key = key.strip()
+                if key:
+                    query.sort.append((key.lstrip('+-'), key.startswith('-')))
+
+        elif text.startswith('limit:'):
+            try:
+                query.limit = max(int(text[6:]), 0)
+            except ValueError:
+                raise QueryError('"%s" is not a number.' % text[6:])
+
+        else:
+            query.clauses.append([parse_term(part) for part in text.split('||')])
+
+    # "next" alone means the very next one
+    if query.after != None and query.limit == None and not query.sort:
+        query.limit = 1
+
+    return query
+
+
+
+def parse_term(text):
+    text = text.strip()
+    negate = False
+
+    if text.startswith('!'):
+        negate, text = True, text[1:].strip()
+
+    elif text.lower().startswith('not '):
+        negate, text = True, text[4:].strip()
+
+    if ':' not in text:
+        raise QueryError('"%s" is not like "field:pattern".' % text)
+
+    field, pattern = text.split(':', 1)
+    return Term(field.strip(), pattern, negate)
+
+
+
+def compile_query(queries, fieldtypes):
+    # all queries have to match. None or "all" matches everything.
+    return parse_query(queries).compile(fieldtypes)
+
+
+
+def compile_term(field, pattern, fieldtypes, negate=False):
+    fieldtype = fieldtypes.get(field, None)
+
+    if fieldtype == int:
+        match = compile_int(field, pattern)
+
+    elif fieldtype == datetime:
+        match = compile_date(field, pattern)
+
+    else:
+        match = compile_regex(field, pattern)
+
+    return match if not negate else match_not(match)
+
+
+
+def compile_int(field, pattern):
+    return compile_interval(field, get_interval(pattern, parse_int))
+
+
+
+def compile_date(field, pattern):
+    return compile_interval(field, get_interval(pattern, resolve_date))
+
+
+
+def compile_interval(field, interval):
+    lower, upper = interval
+
+    if lower == upper:
+        return compare_field(field, operator.eq, lower)
+
+    elif upper == None:
+        return compare_field(field, operator.gt, lower)
+
+    elif lower == None:
+        return compare_field(field, operator.lt, upper)
+
+    def match(item):
+        value = item.get(field, None)
+        return value != None and lower <= value <= upper
+
+    return match
+
+
+
+def get_interval(pattern, convert):
+    # (lower, upper) - exclusive for < and >, inclusive for ranges and =
+    if '..' in pattern:
+        lower, upper = pattern.split('..', 1)
+        return convert(lower), convert(upper)
+
+    compare, text = split_comparison(pattern)
+    value = convert(text)
+
+    if compare == operator.gt:
+        return value, None
+    elif compare == operator.lt:
+        return None, value
+    else:
+        return value, value
+
+
+
+def parse_int(text):
+    try:
+        return int(text)
+    except ValueError:
+        raise QueryError('"%s" is not a number.' % text)
+
+
+
+def compile_regex(field, pattern):
+    try:
+        search = re.compile(pattern, re.IGNORECASE).search
+    except re.error as e:
+        raise QueryError('invalid pattern "%s": %s' % (pattern, e))
+
+    def match(item):
+        value = item.get(field, None)
+        if value == None:
+            return False
+
+        if not isinstance(value, str):
+            value = str(value)
+
+        return search(value) != None
+
+    return match
+
+
+
+def compare_field(field, compare, bound):
+    def match(item):
+        value = item.get(field, None)
+        return value != None and compare(value, bound)
+
+    return match
+
+
+
+def split_comparison(pattern):
+    if pattern[:1] in comparisons:
+        return comparisons[pattern[0]], pattern[1:]
+
+    return operator.eq, pattern
+
+
+
+def resolve_date(text, now=None):
+    # "+2d", "-30d" etc. are relative to now, anything else absolute.
+    now = datetime.now() if now == None else now
+
+    match = re.match(r'^([+-]\d+)([mhdwy])$', text.strip().lower())
+    if match:
+        return now + timedeltas[match.group(2)] * int(match.group(1))
+
+    for format in (DATE_FORMAT, '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(text.strip(), format)
+        except ValueError:
+            pass
+
+    raise QueryError('"%s" is neither a date nor a relative time.' % text)
+
+
+
+def match_all(item):
+    return True
+
+
+
+def match_none(item):
+    return False
+
+
+
+def match_not(predicate):
+    def match(item):
+        return not predicate(item)
+
+    return match
+
+
+
+def match_any(predicates):
+    if len(predicates) == 1:
+        return predicates[0]
+
+    def match(item):
+        for predicate in predicates:
+            if predicate(item):
+                return True
+        return False
+
+    return match
+
+
+
+def match_every(predicates):
+    if len(predicates) == 1:
+        return predicates[0]
+
+    def match(item):
+        for predicate in predicates:
+            if not predicate(item):
+                return False
+        return True
+
+    return match
+
+
+
+# execution
+# ===================================================
+
+def apply(query, items, fieldtypes, ordered=False):
+    # filter, sort and limit any iterable of items.
+    # ordered: items already come in the requested order
+    match = query.compile(fieldtypes)
+    found = (item for item in items if match(item))
+    return finish(query, found, ordered)
+
+
+
+def finish(query, found, ordered=False):
+    if ordered or not query.sort:
+        if query.limit != None:
+            return list(itertools.islice(found, query.limit))
+        return list(found)
+
+    # a single key and a limit - keep the top k only
+    if len(query.sort) == 1 and query.limit != None:
+        field, reverse = query.sort[0]
+        select = heapq.nlargest if reverse else heapq.nsmallest
+        return select(query.limit, found, key=sort_key(field))
+
+    result = list(found)
+    for field, reverse in reversed(query.sort):
+        result.sort(key=sort_key(field), reverse=reverse)
+
+    return result[:query.limit] if query.limit != None else result
+
+
+
+def sort_key(field):
+    # items without the field go last
+    def key(item):
+        value = item.get(field, None)
+        return (0, value) if value != None else (1, 0)
+
+    return key
+
+
+
+def search_records(query, store, fieldtypes, extend=None):
+    # uses the indexes of store to pick candidates, then runs the
+    # predicates on those only. Records are ordered by start by default.
+    candidates, ordered = plan_records(query, store, fieldtypes)
+
+    if not ordered:
+        candidates = sorted(candidates, key=lambda r: r.get('start', 0))
+
+    items = candidates if extend == None else (extend(r) for r in candidates)
+    by_start = not query.sort or query.sort == [('start', False)] or query.sort == [('startdate', False)]
+    return apply(query, items, fieldtypes, by_start)
+
+
+
+def plan_records(query, store, fieldtypes):
+    # (candidate records, ordered by start) - the smallest index hit wins
+    plans = []
+
+    # start range
+    lower, upper = get_start_bounds(query, fieldtypes)
+    if lower != None or upper != None:
+        plans.append((store.count_between(lower, upper), 'start', (lower, upper)))
+
+    for term in query.single_terms():
+        if term.field == 'state' and fieldtypes.get('state', None) == None:
+            search = compile_regex('state', term.pattern)
+            states = [state for state in store.record_states() if state != None and search({'state': state})]
+            plans.append((sum(store.count_in_state(state) for state in states), 'state', states))
+
+        elif term.field == 'channel' and fieldtypes.get('channel', None) == int:
+            lower, upper = get_interval(term.pattern, parse_int)
+            if lower == upper:
+                plans.append((store.count_on_channel(lower), 'channel', [lower]))
+
+        elif term.field == 'channelname' and fieldtypes.get('channelname', None) == None:
+            search = compile_regex('channelName', term.pattern)
+            channels = [id for id, channel in list(store.channels.items()) if search(channel)]
+            plans.append((sum(store.count_on_channel(id) for id in channels), 'channel', channels))
+
+    # text searches, a clause of alternatives gives the union
+    for clause in query.clauses:
+        if any(term.negate or fieldtypes.get(term.field, None) != None for term in clause):
+            continue
+
+        ids = set()
+        for term in clause:
+            found = store.text_candidates(term.field, term.pattern)
+            if found == None:
+                break
+            ids.update(found)
+        else:
+            plans.append((len(ids), 'ids', ids))
+
+    # numeric and date clauses as one mask over the record columns
+    best = min(plan[0] for plan in plans) if plans else len(store.records)
+    if best >= COLUMNS_MIN:
+        columns = store.columns()
+        mask = compile_mask(query, fieldtypes, columns)
+        if mask is not None:
+            plans.append((columns.count(mask), 'columns', columns.select(mask)))
+
+    if not plans:
+        return store.records_sorted(), True
+
+    count, kind, keys = min(plans, key=lambda plan: plan[0])
+
+    if kind == 'start':
+        return store.records_between(*keys), True
+
+    elif kind == 'columns':
+        # the columns are ordered by start
+        records = store.records
+        return [records[id] for id in keys if id in records], True
+
+    elif kind == 'ids':
+        return [store.records[id] for id in keys if id in store.records], False
+
+    elif kind == 'state':
+        return [r for state in keys for r in store.records_in_state(state)], False
+
+    else:
+        return [r for channel in keys for r in store.records_on_channel(channel)], False
+
+
+
+def get_start_bounds(query, fieldtypes):
+    # narrowest [lower, upper) of record starts, in timestamps
+    lower = query.after
+    upper = None
+
+    for term in query.single_terms():
+        if term.field == 'start' and fieldtypes.get('start', None) == int:
+            low, high = get_interval(term.pattern, parse_int)
+
+        elif term.field == 'startdate' and fieldtypes.get('startdate', None) == datetime:
+            low, high = get_interval(term.pattern, resolve_date)
+            low = int(low.timestamp()) if low != None else None
+            high = int(high.timestamp()) if high != None else None
+
+        else:
+            continue
+
+        # superset is fine, the predicates check exactly
+        if low != None:
+            lower = low if lower == None else max(lower, low)
+
+        if high != None:
+            upper = high + 1 if upper == None else min(upper, high + 1)
+
+    return lower, upper
+
+
+
+# column masks
+# ===================================================
+
+def compile_mask(query, fieldtypes, columns):
+    # mask of the clauses that can be answered by columns alone, None if
+    # there are none. The predicates still run on the selected records.
+    mask = None
+
+    for clause in query.clauses:
+        alternatives = [mask_term(term, fieldtypes, columns) for term in clause]
+        # masks may be arrays, so no == here
+        if any(found is None for found in alternatives):
+            continue
+
+        found = alternatives[0]
+        for other in alternatives[1:]:
+            found = columns.either(found, other)
+
+        mask = found if mask is None else columns.both(mask, found)
+
+    if query.after != None:
+        found = columns.compare('start', operator.gt, query.after)
+        mask = found if mask is None else columns.both(mask, found)
+
+    return mask
+
+
+
+def mask_term(term, fieldtypes, columns):
+    fieldtype = fieldtypes.get(term.field, None)
+
+    if fieldtype == int and term.field in columns.fields:
+        mask = mask_interval(columns, term.field, get_interval(term.pattern, parse_int))
+
+    elif fieldtype == datetime and term.field == 'startdate':
+        lower, upper = get_interval(term.pattern, resolve_date)
+        lower = lower.timestamp() if lower != None else None
+        upper = upper.timestamp() if upper != None else None
+        mask = mask_interval(columns, 'start', (lower, upper))
+
+    elif fieldtype == None and term.field == 'state':
+        search = compile_regex('state', term.pattern)
+        mask = columns.in_states([state for state in columns.states if search({'state': state})])
+
+    else:
+        return None
+
+    return mask if not term.negate else columns.invert(mask)
+
+
+
+def mask_interval(columns, field, interval):
+    # same bounds as compile_interval
+    lower, upper = interval
+
+    if lower == upper:
+        return columns.compare(field, operator.eq, lower)
+
+    elif upper == None:
+        return columns.compare(field, operator.gt, lower)
+
+    elif lower == None:
+        return columns.compare(field, operator.lt, upper)
+
+    return columns.between(field, lower, upper)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+import re
+import time
+import heapq
+
+
+# Picks completed recordings to delete until the disk has a target of
+# free space. Every recording gets a cost of losing it, weighted by the
+# policy - older, watched and duplicated recordings are cheap, channels
+# may be weighted up or down. Recordings are taken cheapest per byte
+# first from a heap, so only as many are ordered as are needed.
+
+DAY = 24 * 3600
+
+# bytes per second if the server doesn't report dataSize, about HD
+ESTIMATED_BYTERATE = 1000000
+
+units = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30, 't': 1 << 40}
+
+
+class RetentionPolicy(object):
+
+    # age: weight of age in months, watched: weight of played recordings,
+    # duplicates: weight of older copies of the same title and subtitle,
+    # channels: channel id -> factor (see resolve_channels), keep_days:
+    # never touch recordings younger than this.
+
+    def __init__(self, age=1.0, watched=1.0, duplicates=1.0, channels=None, keep_days=0,
+                 byterate=ESTIMATED_BYTERATE):
+        self.age = age
+        self.watched = watched
+        self.duplicates = duplicates
+        self.channels = channels or {}
+        self.keep_days = keep_days
+        self.byterate = byterate
+
+
+    def cost(self, record, now, duplicate=False):
+        cost = 1.0
+
+        age = max(now - record.get('stop', now), 0) / float(DAY)
+        cost /= 1.0 + self.age * age / 30.0
+
+        if is_watched(record):
+            cost /= 1.0 + self.watched
+
+        if duplicate:
+            cost /= 1.0 + self.duplicates
+
+        return cost * self.channels.get(record.get('channel', None), 1.0)
+
+
+    def get_size(self, record):
+        size = record.get('dataSize', None)
+        if size:
+            return size
+
+        return max(record.get('stop', 0) - record.get('start', 0), 0) * self.byterate
+
+
+
+class RetentionPlan(object):
+
+    def __init__(self, records, freed, needed, free=None, total=None):
+        self.records = records
+        self.freed = freed
+        self.needed = needed
+        self.free = free
+        self.total = total
+
+
+    def ids(self):
+        return [record['id'] for record in self.records]
+
+
+    @property
+    def sufficient(self):
+        return self.freed >= self.needed
+
+
+
+def plan_retention(records, needed, policy, now=None):
+    # cheapest completed records freeing at least needed bytes
+    now = time.time() if now == None else now
+    keep_after = now - policy.keep_days * DAY
+
+    candidates = [r for r in records if r.get('state', None) == 'completed' and r.get('stop', 0) < keep_after]
+    duplicates = find_duplicates(candidates)
+
+    heap = []
+    for record in candidates:
+        size = policy.get_size(record)
+        if size <= 0:
+            continue
+
+        cost = policy.cost(record, now, record['id'] in duplicates)
+        heap.append((cost / size, record['start'], record['id'], size, record))
+
+    heapq.heapify(heap)
+
+    selected = []
+    freed = 0
+    while heap and freed < needed:
+        ratio, start, id, size, record = heapq.heappop(heap)
+        selected.append(record)
+        freed += size
+
+    return RetentionPlan(selected, freed, needed)
+
+
+
+def plan_disk_space(client, target, policy, records=None, now=None):
+    # target: bytes to be free, see parse_target. records default to all
+    # completed records of the client.
+    space = client.get_disk_space()
+    free = space.get('freediskspace', 0)
+    total = space.get('totaldiskspace', 0)
+
+    if isinstance(target, str):
+        target = parse_target(target, total)
+
+    if records == None:
+        records = client.store.records_in_state('completed')
+
+    plan = plan_retention(records, max(target - free, 0), policy, now)
+    plan.free = free
+    plan.total = total
+    return plan
+
+
+
+def resolve_channels(weights, channels):
+    # channel name or id -> factor into channel id -> factor. Names are
+    # compared ignoring case, unknown channels raise ValueError.
+    names = dict((channel.get('channelName', '').lower(), id) for id, channel in channels.items())
+
+    result = {}
+    for key, factor in weights.items():
+        if isinstance(key, int) or key.strip().isdigit():
+            id = int(key)
+        else:
+            id = names.get(key.strip().lower(), None)
+
+        if id not in channels:
+            raise ValueError('no channel "%s"' % key)
+
+        result[id] = factor
+
+    return result
+
+
+
+def find_duplicates(records):
+    # ids of records having a newer copy (same title and subtitle)
+    newest = {}
+    for record in records:
+        key = (record.get('title', None), record.get('subtitle', None))
+        if key[0] == None:
+            continue
+
+        other = newest.get(key, None)
+        if other == None or other.get('start', 0) < record.get('start', 0):
+            newest[key] = record
+
+    return set(r['id'] for r in records
+               if r.get('title', None) != None
+               and newest[(r['title'], r.get('subtitle', None))] is not r)
+
+
+
+def is_watched(record):
+    return bool(record.get('playcount', 0) or record.get('playposition', 0))
+
+
+
+def parse_target(text, total=0):
+    # "50G", "500m", "1234" (bytes) or "10%" of total
+    text = text.strip().lower()
+
+    if text.endswith('%'):
+        return int(total * float(text[:-1]) / 100)
+
+    match = re.match(r'^(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?$', text)
+    if not match:
+        raise ValueError('"%s" is neither a size nor a percentage.' % text)
+
+    return int(float(match.group(1)) * units[match.group(2)])
+
+
+
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(size) < 1024:
+            return '%.1f %s' % (size, unit)
+        size /= 1024.0
+
+    return '%.1f TiB' % size
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+import time
+import heapq
+import threading
+
+
+class WakeScheduler(object):
+
+    # Keeps the start/stop of upcoming records in a heap, fed by the
+    # dvrEntry callbacks. Changed or deleted records leave stale heap
+    # entries behind, they are dropped when they come up. next_wake()
+    # merges back-to-back records: a record starting at most merge_gap
+    # seconds after the end of a running chain needs no wakeup of its own.
+
+    states = ('scheduled', 'recording')
+
+    def __init__(self, merge_gap=600):
+        self.merge_gap = merge_gap
+        self._lock = threading.Lock()
+        self._heap = []
+        self._entries = {}
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def update(self, record):
+        # add or change, records of other states are removed
+        id = record['id']
+
+        with self._lock:
+            if record.get('state', None) not in self.states:
+                self._entries.pop(id, None)
+                return
+
+            entry = (record.get('start', 0), record.get('stop', 0), id)
+            if self._entries.get(id, None) == entry:
+                return
+
+            self._entries[id] = entry
+            heapq.heappush(self._heap, entry)
+
+            # stale entries pile up on many updates
+            if len(self._heap) > 2 * len(self._entries) + 64:
+                self._heap = list(self._entries.values())
+                heapq.heapify(self._heap)
+
+
+    def remove(self, id):
+        with self._lock:
+            self._entries.pop(id, None)
+
+
+    def next_wake(self, now=None):
+        # (start, id) of the first record needing a wakeup, or None
+        now = time.time() if now == None else now
+
+        with self._lock:
+            heap = self._heap
+            taken = []
+            chain_end = None
+            result = None
+
+            while heap:
+                entry = heapq.heappop(heap)
+                start, stop, id = entry
+
+                # stale or over
+                if self._entries.get(id, None) != entry or stop <= now:
+                    if self._entries.get(id, None) == entry:
+                        del self._entries[id]
+                    continue
+
+                taken.append(entry)
+
+                if start <= now:
+                    # running, keeps the box awake until stop
+                    chain_end = stop if chain_end == None else max(chain_end, stop)
+
+                elif chain_end != None and start - chain_end <= self.merge_gap:
+                    # follows closely, the box is still awake
+                    chain_end = max(chain_end, stop)
+
+                else:
+                    result = (start, id)
+                    break
+
+            for entry in taken:
+                heapq.heappush(heap, entry)
+
+            return result
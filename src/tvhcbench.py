@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+from tvhc import *
+from tvhc import tvhcoutput
+from tvhc.htspfakeserver import HtspFakeServer, HtspFakeDataset
+
+
+# Benchmarks of the hot paths: HTSP encode/decode, the initial sync
+# against a local fake server and query/format in tvhclib. Every result
+# is seconds per operation (lower is better) - --max name=SECONDS or a
+# --thresholds file fail the run if exceeded.
+
+
+def get_corpora():
+    # realistic messages, as tvheadend sends them
+    now = int(time.time())
+    words = 'the quick brown fox jumps over the lazy dog and keeps running '
+
+    dvr = [{'method': 'dvrEntryAdd', 'id': i, 'channel': i % 50, 'start': now + i * 60,
+            'stop': now + i * 60 + 3600, 'startExtra': 2, 'stopExtra': 5, 'title': 'Title %s' % i,
+            'subtitle': 'Episode %s' % i, 'description': words * 4, 'state': 'scheduled',
+            'dataSize': 1 << 32, 'playcount': 0} for i in range(1000)]
+
+    events = [{'method': 'eventAdd', 'eventId': i, 'channelId': i % 50, 'start': now + i * 60,
+               'stop': now + i * 60 + 1800, 'title': 'Event %s' % i, 'summary': words * 2,
+               'description': words * 30, 'contentType': 0x10} for i in range(1000)]
+
+    channels = [{'method': 'channelAdd', 'channelId': i, 'channelNumber': i, 'channelName': 'Channel %s' % i,
+                 'eventId': i * 10, 'nextEventId': i * 10 + 1, 'tags': [1, 2, 3],
+                 'services': [{'name': 'DVB-T/Mux %s/Channel %s' % (i % 8, i), 'type': 'HDTV',
+                               'video': 'H264', 'caid': 0} for _ in range(3)]} for i in range(1000)]
+
+    muxpkt = [{'method': 'muxpkt', 'subscriptionId': 1, 'frametype': 73, 'stream': 1,
+               'com': 1, 'pts': i * 3600, 'dts': i * 3600, 'duration': 3600,
+               'payload': os.urandom(1316 * 7)} for i in range(1000)]
+
+    return {'dvrEntryAdd': dvr, 'eventAdd': events, 'channelAdd': channels, 'muxpkt': muxpkt}
+
+
+
+def measure(func, repeat):
+    # best of repeat runs, in seconds
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+
+    return best
+
+
+
+def result(name, seconds, count=1, bytes=None):
+    entry = {'name': name, 'seconds': seconds / count, 'rate': count / seconds if seconds else None}
+    if bytes != None:
+        entry['mbps'] = bytes / seconds / 1e6 if seconds else None
+    return entry
+
+
+
+def bench_protocol(repeat):
+    protocol = HtspProtocol()
+    lazy = HtspProtocol(lazy=True)
+    results = []
+
+    for name, messages in sorted(get_corpora().items()):
+        frames = [bytes(protocol.serialize(m))[4:] for m in messages]
+        size = sum(len(frame) for frame in frames)
+
+        seconds = measure(lambda: [protocol.serialize(m) for m in messages], repeat)
+        results.append(result('encode.%s' % name, seconds, len(messages), size))
+
+        seconds = measure(lambda: [protocol.deserialize(f) for f in frames], repeat)
+        results.append(result('decode.%s' % name, seconds, len(frames), size))
+
+        seconds = measure(lambda: [lazy.deserialize(f)['method'] for f in frames], repeat)
+        results.append(result('decode_lazy.%s' % name, seconds, len(frames), size))
+
+    return results
+
+
+
+def bench_sync(sizes, repeat):
+    results = []
+
+    for size in sizes:
+        dataset = HtspFakeDataset(records=size, events=size)
+
+        with HtspFakeServer(dataset=dataset) as server:
+            def sync():
+                client = HtspClient(epg=True)
+                try:
+                    if not client.try_open('127.0.0.1', port=server.port, timeout=120):
+                        raise Exception('sync with the fake server failed')
+                finally:
+                    client.close()
+
+            seconds = measure(sync, repeat)
+            results.append(result('sync.%s' % size, seconds))
+
+    return results
+
+
+
+def bench_query(size, repeat):
+    results = []
+    dataset = HtspFakeDataset(records=size)
+
+    with HtspFakeServer(dataset=dataset) as server:
+        client = HtspClient()
+        client.store.enable_text_index()
+        if not client.try_open('127.0.0.1', port=server.port, timeout=120):
+            raise Exception('sync with the fake server failed')
+
+        queries = {'all': ['all'],
+                   'title': ['title:news'],
+                   'title_escaped': ['title:\\x48ouse'],
+                   'startdate': ['startdate:<-30d'],
+                   'combined': ['state:completed', 'duration:>3000', 'sort:-start', 'limit:100']}
+
+        for name, query in sorted(queries.items()):
+            seconds = measure(lambda: tvhclib.search_records(client, query), repeat)
+            results.append(result('query.%s' % name, seconds))
+
+        records = tvhclib.search_records(client, ['all'])
+
+        def template():
+            text = io.StringIO()
+            tvhclib.write_formatted(records, tvhclib.formats['record'], text)
+
+        seconds = measure(template, repeat)
+        results.append(result('format.template', seconds, len(records)))
+
+        for format in sorted(tvhcoutput.writers):
+            seconds = measure(lambda: tvhcoutput.write_items(records, format, io.BytesIO()), repeat)
+            results.append(result('format.%s' % format, seconds, len(records)))
+
+        client.close()
+
+    return results
+
+
+
+def check_thresholds(results, thresholds):
+    # names of results slower than their threshold
+    failed = []
+    for entry in results:
+        limit = thresholds.get(entry['name'], None)
+        if limit != None and entry['seconds'] > limit:
+            failed.append(entry['name'])
+
+    return failed
+
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Benchmarks of protocol, sync, query and output.')
+    parser.add_argument('--suite', action='append', choices=['protocol', 'sync', 'query'], default=None,
+                        help='Suites to run. Default are all.')
+    parser.add_argument('--sizes', default='1000,5000,20000',
+                        help='Record counts for the sync suite. Default is "1000,5000,20000".')
+    parser.add_argument('--records', type=int, default=20000,
+                        help='Record count for the query suite. Default is 20000.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per benchmark, the best counts. Default is 3.')
+    parser.add_argument('--output', '-o', default=None, metavar='PATH',
+                        help='Write the results as JSON to PATH instead of stdout.')
+    parser.add_argument('--thresholds', default=None, metavar='PATH',
+                        help='JSON file of name -> max seconds per operation.')
+    parser.add_argument('--max', action='append', default=[], metavar='NAME=SECONDS',
+                        help='Max seconds per operation of one benchmark.')
+    return parser
+
+
+
+if __name__ == '__main__':
+
+    args = create_parser().parse_args()
+    suites = args.suite or ['protocol', 'sync', 'query']
+
+    thresholds = {}
+    if args.thresholds:
+        with open(args.thresholds) as f:
+            thresholds.update(json.load(f))
+
+    for text in args.max:
+        name, _, seconds = text.rpartition('=')
+        thresholds[name] = float(seconds)
+
+    results = []
+    if 'protocol' in suites:
+        results += bench_protocol(args.repeat)
+
+    if 'sync' in suites:
+        sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+        results += bench_sync(sizes, args.repeat)
+
+    if 'query' in suites:
+        results += bench_query(args.records, args.repeat)
+
+    failed = check_thresholds(results, thresholds)
+    report = {'python': sys.version.split()[0],
+              'time': int(time.time()),
+              'results': results,
+              'failed': failed}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print("")
+
+    seconds = dict((entry['name'], entry['seconds']) for entry in results)
+    for name in failed:
+        print('Threshold exceeded: %s took %.6fs, max is %.6fs' % (name, seconds[name], thresholds[name]), file=sys.stderr)
+
+    sys.exit(1 if failed else 0)
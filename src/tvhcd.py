@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import signal
+import threading
+from tvhc import *
+from tvhc.tvhcdaemon import TvhcDaemon
+
+
+def extend_parser(parser):
+    parser.add_argument('--epg', action='store_true', default=False,
+                        help='Also keep the EPG in sync.')
+
+    parser.add_argument('--check', type=int, default=30, metavar='SECONDS',
+                        help='Interval of the liveness check of the connection to tvheadend. Default is 30.')
+
+    parser.add_argument('--mode', type=lambda text: int(text, 8), default=0o600, metavar='OCTAL',
+                        help='Permissions of the socket, like 660 to serve a group. Default is 600.')
+
+
+def stop(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def connect(args, host, port):
+    client = tvhclib.create_client(args, epg=args.epg)
+
+    # serves many searches, so the trigram indexes pay off here
+    if client.try_open(host, port=port, timeout=60):
+        client.store.build_text_index()
+        client.epg.build_text_index()
+        return client
+
+    client.close()
+    return None
+
+
+def is_alive(client):
+    # a half open connection shows on a request only
+    if not client.is_connected():
+        return False
+
+    try:
+        client.get_sys_time()
+        return True
+    except Exception:
+        return False
+
+
+if __name__ == '__main__':
+
+    # parse arguments
+    parser = tvhclib.create_parser(extend=extend_parser)
+    parser.description = ('Keeps one synced connection to tvheadend and serves it to '
+                          'tvhcrec and tvhcwake via a unix socket.')
+    args = parser.parse_args()
+
+    # get host & port
+    host, port = tvhclib.parse_host(args.host)
+
+    # connect and sync once
+    client = connect(args, host, port)
+    if client == None:
+        tvhclib.open_fail(True)
+
+    # serve until terminated
+    signal.signal(signal.SIGTERM, stop)
+    server = TvhcDaemon(client, args.socket, mode=args.mode)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print('Serving %s:%s on "%s".' % (host, port, args.socket))
+    sys.stdout.flush()
+
+    try:
+        while True:
+            time.sleep(args.check)
+            if is_alive(server.client):
+                continue
+
+            # clients connect directly until the daemon is back
+            print('Lost connection to %s:%s, reconnecting.' % (host, port))
+            sys.stdout.flush()
+            server.client.close()
+
+            client = connect(args, host, port)
+            while client == None:
+                time.sleep(args.check)
+                client = connect(args, host, port)
+
+            server.client = client
+            print('Reconnected to %s:%s.' % (host, port))
+            sys.stdout.flush()
+
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.client.close()
@@ -6,6 +6,8 @@ import sys
 import time
 from datetime import datetime, timedelta
 from tvhc import *
+from tvhc import tvhcquery, tvhcoutput, tvhcretention
+from tvhc.htspbulk import print_progress
 
 
 def extend_parser(parser):
@@ -14,6 +16,139 @@ def extend_parser(parser):
     parser.add_argument('--delete', action='store_true', default = False,
                         help = 'Deletes found items.') 
 
+    parser.add_argument('--inflight', type=int, default=32, metavar='N',
+                        help = 'Requests sent ahead of their answers on --delete. Default is 32.')
+
+    parser.add_argument('--rate', type=float, default=None, metavar='N',
+                        help = 'Send at most N requests per second on --delete. Default is no limit.')
+
+    parser.add_argument('--retention', default=None, metavar='SIZE',
+                        help = 'Plans to delete completed records until SIZE is free, like "50G" or "10%%". '
+                               'Queries narrow the candidates. Shows the plan, deletes it with --delete.')
+
+    parser.add_argument('--weight-age', type=float, default=1.0, metavar='W',
+                        help = 'Retention: how much age per month makes a record cheaper. Default is 1.0.')
+
+    parser.add_argument('--weight-watched', type=float, default=1.0, metavar='W',
+                        help = 'Retention: how much cheaper watched records are. Default is 1.0.')
+
+    parser.add_argument('--weight-duplicates', type=float, default=1.0, metavar='W',
+                        help = 'Retention: how much cheaper older copies of a title are. Default is 1.0.')
+
+    parser.add_argument('--weight-channel', action='append', default=[], metavar='CHANNEL=W',
+                        help = 'Retention: factor for records of a channel (name or id), above 1 keeps them longer.')
+
+    parser.add_argument('--keep-days', type=int, default=0, metavar='DAYS',
+                        help = 'Retention: never plan records younger than DAYS. Default is 0.')
+
+    parser.add_argument('--conflicts', action='store_true', default=False,
+                        help = 'Shows peak tuner load and periods of scheduled records needing more than --tuners. Exits with 2 on conflicts.')
+
+    parser.add_argument('--tuners', type=int, default=1, metavar='N',
+                        help = 'Conflicts: count of tuners. Default is 1.')
+
+    parser.add_argument('--days', type=int, default=7, metavar='DAYS',
+                        help = 'Conflicts: days ahead to check. Default is 7.')
+
+    parser.add_argument('--by', choices=['mux', 'channel', 'record'], default='mux',
+                        help = 'Conflicts: what needs a tuner of its own. Records on one mux share a tuner by default.')
+
+    parser.add_argument('--free-slots', action='store_true', default=False,
+                        help = 'Conflicts: also list periods with a free tuner.')
+
+
+
+def get_policy(client, args):
+    weights = {}
+    for text in args.weight_channel:
+        name, _, weight = text.rpartition('=')
+        weights[name] = float(weight)
+
+    return tvhcretention.RetentionPolicy(age=args.weight_age,
+                                        watched=args.weight_watched,
+                                        duplicates=args.weight_duplicates,
+                                        channels=tvhcretention.resolve_channels(weights, client.channels),
+                                        keep_days=args.keep_days)
+
+
+
+def get_retention_plan(client, args):
+    # candidates are all completed records, or those found by the queries
+    records = None
+    if args.query:
+        records = [client.records[r['id']] for r in tvhclib.search_records(client, args.query)]
+
+    return tvhcretention.plan_disk_space(client, args.retention, get_policy(client, args), records)
+
+
+
+def print_retention_plan(plan):
+    size = tvhcretention.format_size
+    print("Free %s of %s, %s more needed. Plan frees %s with %s records%s." % (
+          size(plan.free), size(plan.total), size(plan.needed), size(plan.freed),
+          len(plan.records), '' if plan.sufficient else ' - not enough'))
+
+
+def get_tuner_key(client, by):
+    # records of equal key share a tuner
+    records = client.records
+
+    if by == 'record':
+        return None
+    elif by == 'channel':
+        return lambda id: records[id].get('channel', None)
+    else:
+        return lambda id: tvhclib.get_mux(client, records[id].get('channel', None))
+
+
+
+def print_conflicts(client, args):
+    intervals = client.store.intervals
+    key = get_tuner_key(client, args.by)
+    start = int(time.time())
+    stop = start + args.days * 24 * 3600
+
+    def date(timestamp):
+        return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M')
+
+    count, begin, end = intervals.max_concurrent(start, stop, key)
+    if count == 0:
+        print("No scheduled records within %s days." % args.days)
+        return True
+
+    print("Peak: %s tuners needed %s - %s." % (count, date(begin), date(end)))
+
+    conflicts = intervals.conflicts(args.tuners, start, stop, key)
+    involved = {}
+
+    for begin, end, count, ids in conflicts:
+        print("")
+        print("%s - %s: %s tuners needed" % (date(begin), date(end), count))
+        for id in sorted(ids, key=lambda id: client.records[id].get('start', 0)):
+            record = tvhclib.extend_record(client, client.records[id])
+            group = key(id) if key != None else id
+            involved.setdefault(group, set()).add(id)
+            print("  %6s: %s %s (%s, %s)" % (id, record['startdate'], record.get('title', ''),
+                                           record['channelname'], group))
+
+    if involved:
+        print("")
+        print("Records in conflicts by %s:" % args.by)
+        for group, ids in sorted(involved.items(), key=lambda item: -len(item[1])):
+            print("  %-30s %s" % (group, len(ids)))
+
+    print("")
+    print("%s conflicts with %s tuners within %s days." % (len(conflicts), args.tuners, args.days))
+
+    if args.free_slots:
+        print("")
+        print("Free slots:")
+        for begin, end in intervals.free_slots(args.tuners, start, stop, key):
+            print("  %s - %s (%s)" % (date(begin), date(end), timedelta(seconds=end - begin)))
+
+    return not conflicts
+
+
 
 if __name__ == '__main__':
     
@@ -25,29 +160,50 @@ if __name__ == '__main__':
     host, port = tvhclib.parse_host(args.host)
 
     # what's to do?
-    with HtspClient() as client:
-        if not client.try_open(host, port):
-            tvhclib.open_fail(True)
+    client = tvhclib.open_client(args, host, port)
+    if client == None:
+        tvhclib.open_fail(True)
     
-        # get all records sorted by date with extended data.
-        records = client.records.values()
-        records = sorted(records, key=lambda rec: rec['start']) 
-        records = map(lambda r: tvhclib.extend_record(client, r), records)
-        
-        # filter by given query - if any
-        fieldtypes = tvhclib.fieldtypes['record']
-        records = list(tvhclib.search_items(records, fieldtypes, args.query))
+    with client:
+        if args.conflicts:
+            sys.exit(0 if print_conflicts(client, args) else 2)
+
+        # search records sorted by date with extended data.
+        try:
+            if args.retention:
+                plan = get_retention_plan(client, args)
+                records = [tvhclib.extend_record(client, r) for r in plan.records]
+            else:
+                records = tvhclib.search_records(client, args.query)
+        except tvhcquery.QueryError as e:
+            print("Invalid query: %s" % e)
+            sys.exit(1)
+        except ValueError as e:
+            print("Invalid retention: %s" % e)
+            sys.exit(1)
         
         # print with given format
         format = args.format or tvhclib.formats['record']
-        proceed, count = tvhclib.print_items(records, format)
+        columns = tvhcoutput.parse_columns(args.columns)
+        proceed, count = tvhclib.print_items(records, format, columns)
         
         if not proceed:
             sys.exit()
+
+        if args.retention:
+            print_retention_plan(plan)
         
         # what to do next?
         if args.delete and count > 0:
             if args.noconfirm or tvhclib.ask_for_delete(count, 'record'):
-                for record_id in map(lambda r: r['id'], records):
-                    client.delete_record(record_id)
-                    print("ID %s deleted." % record_id)
+                ids = [r['id'] for r in records]
+                try:
+                    results = client.delete_records(ids, args.inflight, args.rate, print_progress)
+                except (OSError, EOFError, RuntimeError) as e:
+                    print("Delete aborted: %s" % (str(e) or type(e).__name__))
+                    sys.exit(1)
+                failed = [result for result in results if not result.ok]
+
+                print("%s deleted, %s failed." % (len(results) - len(failed), len(failed)))
+                if failed:
+                    sys.exit(1)
@@ -4,13 +4,17 @@ import re
 import os
 import sys
 import time
+import signal
+import threading
 from datetime import datetime, timedelta
 from tvhc import *
+from tvhc.tvhcwakeup import WakeScheduler
 
 # define default values
 default_ahead = 300
 default_persistent = '/var/tmp/tvhc_wakeup'
 default_device = '/sys/class/rtc/rtc0/wakealarm'
+default_merge = 600
 
 
 def clear_wake(persistent, device):
@@ -30,6 +34,65 @@ def set_wake(persistent, device, timestamp):
             f.write("%s\n" % int(timestamp))
 
 
+
+def update_wake(persistent, device, timestamp):
+    # writes only if the planned wakeup changes, True if so
+    current = tvhclib.query_wake_timestamp(persistent)
+
+    if timestamp == None:
+        if current == 0:
+            return False
+        clear_wake(persistent, device)
+        return True
+
+    if current == int(timestamp):
+        return False
+
+    set_wake(persistent, device, timestamp)
+    return True
+
+
+
+def watch(client, args):
+    # stays connected, replans on every change of the dvr entries
+    scheduler = WakeScheduler(args.merge)
+    changed = threading.Event()
+
+    def received(method, msg):
+        if method in ('dvrEntryAdd', 'dvrEntryUpdate'):
+            record = client.records.get(msg['id'], None)
+            if record != None:
+                scheduler.update(record)
+            changed.set()
+
+        elif method == 'dvrEntryDelete':
+            scheduler.remove(msg['id'])
+            changed.set()
+
+    client.add_listener(received)
+    for record in list(client.records.values()):
+        scheduler.update(record)
+
+    while client.is_connected():
+        found = scheduler.next_wake()
+
+        if found == None:
+            if update_wake(args.persistent, args.device, None):
+                print("No planned record found, wakeup cleared.")
+        else:
+            start, id = found
+            timestamp = int(start) - args.ahead
+            if update_wake(args.persistent, args.device, timestamp):
+                print_wake_set(timestamp, client.records.get(id, {}).get('title', None))
+
+        # replan on changes, at least once a minute - running
+        # records end and the chain of merged ones may break up
+        changed.wait(60)
+        changed.clear()
+
+    print("Connection lost.")
+
+
 def extend_parser(parser):
     parser.add_argument('--device', '-d', default=default_device, metavar="PATH",
                         help='Defines the RTC device. Default value is "%s"' % default_device)
@@ -52,6 +115,12 @@ def extend_parser(parser):
     parser.add_argument('--waked', '-w', action='store_true', default=False,
                         help='Guess if machine was waked up for a record.')
 
+    parser.add_argument('--watch', action='store_true', default=False,
+                        help='Stays connected and updates the wakeup on any change of the records.')
+
+    parser.add_argument('--merge', type=int, default=default_merge, metavar='SECONDS',
+                        help='Watch: records starting at most SECONDS after a running one need no own wakeup. Default is %s.' % default_merge)
+
 
 def print_wake_set(timestamp, title=None):
     dt = datetime.fromtimestamp(timestamp).isoformat()
@@ -89,6 +158,26 @@ if __name__ == '__main__':
             print("No planned wakeup found.") 
     
     
+    elif args.watch:
+        if args.ahead == -1:
+            args.ahead = default_ahead
+
+        # callbacks need a connection to tvheadend itself, not tvhcd
+        client = tvhclib.create_client(args)
+        if not client.try_open(host, port=port):
+            tvhclib.open_fail(True)
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        with client:
+            try:
+                watch(client, args)
+            except KeyboardInterrupt:
+                sys.exit(0)
+
+        # connection lost - let systemd restart
+        sys.exit(1)
+
     elif args.clear:
         clear_wake(args.persistent, args.device)
         print("Wakeup cleared.")
@@ -122,10 +211,11 @@ if __name__ == '__main__':
             args.ahead = default_ahead
 
         # connect and get next record
-        with HtspClient() as client:
-            if not client.try_open(host, port):
-                tvhclib.open_fail(True)
-            
+        client = tvhclib.open_client(args, host, port)
+        if client == None:
+            tvhclib.open_fail(True)
+        
+        with client:
             # get next future record
             next_record = tvhclib.get_next_record(client)
             
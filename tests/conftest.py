@@ -0,0 +1,7 @@
+#!/usr/bin/env python
+
+import os
+import sys
+
+# the package lives in src, as setup.py installs it from there
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+from tvhc.htspepg import HtspEpgStore
+
+
+def event(id, start, title, subtitle=None):
+    return {'eventId': id, 'channelId': 1, 'start': start, 'stop': start + 10,
+            'title': title, 'subtitle': subtitle}
+
+
+
+def test_strings_are_shared():
+    store = HtspEpgStore()
+    store.add(event(1, 0, ''.join(['Ne', 'ws'])))
+    store.add(event(2, 10, ''.join(['New', 's'])))
+    assert store.get(1)['title'] is store.get(2)['title']
+
+
+
+def test_strings_are_released():
+    store = HtspEpgStore()
+    store.add(event(1, 0, 'News', 'Today'))
+    store.add(event(2, 10, 'News', 'Tomorrow'))
+    store.add(event(3, 20, 'Film'))
+    assert sorted(store._strings) == ['Film', 'News', 'Today', 'Tomorrow']
+
+    # changed, pruned and removed events drop their strings
+    store.update({'eventId': 2, 'subtitle': 'Later'})
+    assert sorted(store._strings) == ['Film', 'Later', 'News', 'Today']
+
+    assert store.remove_before(15) == 1
+    assert sorted(store._strings) == ['Film', 'Later', 'News']
+
+    store.remove(2)
+    store.remove(3)
+    assert store._strings == {}
+    assert len(store) == 0
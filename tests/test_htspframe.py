@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+import socket
+from tvhc.htspframe import HtspFrameDecoder
+from tvhc.htspprotocol import HtspProtocol
+
+
+protocol = HtspProtocol()
+
+messages = [{'method': 'hello', 'htspversion': 6, 'clientname': 'tvhc'},
+            {'seq': 2, 'title': 'Straße', 'data': b'\x00\x01', 'list': [1, 2, 3], 'map': {'a': -1}},
+            {}]
+
+
+def stream():
+    return b''.join(protocol.serialize(message) for message in messages)
+
+
+
+def test_whole_stream():
+    frames = HtspFrameDecoder().feed(stream())
+    assert [protocol.deserialize(frame) for frame in frames] == messages
+
+
+
+def test_split_anywhere():
+    data = stream()
+    for split in range(len(data) + 1):
+        decoder = HtspFrameDecoder()
+        frames = decoder.feed(data[:split]) + decoder.feed(data[split:])
+        assert [protocol.deserialize(frame) for frame in frames] == messages
+        assert decoder.pending() == 0
+
+
+
+def test_byte_by_byte():
+    decoder = HtspFrameDecoder()
+    frames = []
+    for byte in stream():
+        frames += decoder.feed(memoryview(bytes([byte])))
+
+    assert [protocol.deserialize(frame) for frame in frames] == messages
+
+
+
+def test_incomplete_and_reset():
+    decoder = HtspFrameDecoder()
+    data = protocol.serialize(messages[0])
+    assert decoder.feed(data[:-1]) == []
+    assert decoder.pending() == len(data) - 1
+
+    decoder.reset()
+    assert decoder.pending() == 0
+    assert len(decoder.feed(data)) == 1
+
+
+
+def test_read_from_socket():
+    left, right = socket.socketpair()
+    try:
+        decoder = HtspFrameDecoder(chunk_size=7)
+        right.sendall(stream())
+        right.close()
+
+        frames = []
+        while True:
+            read = decoder.read_from(left)
+            if read == None:
+                break
+            frames += read
+
+        assert [protocol.deserialize(frame) for frame in frames] == messages
+    finally:
+        left.close()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+import pytest
+from tvhc.htspmux import HtspRequestMux
+
+
+def test_replies_by_seq():
+    mux = HtspRequestMux()
+    first, second = {'method': 'a'}, {'method': 'b'}
+    futures = [mux.register(first), mux.register(second)]
+    assert first['seq'] != second['seq']
+    assert mux.pending() == 2
+
+    # any order
+    assert mux.resolve({'seq': second['seq'], 'value': 2})
+    assert mux.resolve({'seq': first['seq'], 'value': 1})
+    assert [future.result(0)['value'] for future in futures] == [1, 2]
+    assert mux.pending() == 0
+
+
+
+def test_replies_without_seq_in_order():
+    mux = HtspRequestMux()
+    futures = [mux.register({}) for i in range(3)]
+    for i in range(3):
+        assert mux.resolve({'value': i})
+
+    assert [future.result(0)['value'] for future in futures] == [0, 1, 2]
+    assert not mux.resolve({'value': 3})
+
+
+
+def test_unknown_seq():
+    mux = HtspRequestMux()
+    mux.register({})
+    assert not mux.resolve({'seq': 12345})
+    assert mux.pending() == 1
+
+
+
+def test_discard():
+    mux = HtspRequestMux()
+    message = {}
+    future = mux.register(message)
+    mux.discard(message)
+    assert mux.pending() == 0
+    assert not mux.resolve({'seq': message['seq']})
+    assert not future.done()
+
+
+
+def test_fail_all():
+    mux = HtspRequestMux()
+    futures = [mux.register({}) for i in range(2)]
+    mux.fail_all(EOFError('closed'))
+    assert mux.pending() == 0
+    for future in futures:
+        with pytest.raises(EOFError):
+            future.result(0)
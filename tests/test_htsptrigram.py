@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+import re
+import random
+import pytest
+from tvhc import tvhcquery
+from tvhc.htspstate import HtspStateStore
+from tvhc.htsptrigram import TrigramIndex, pattern_trigrams, required_literals
+from tvhc.htspfakeserver import HtspFakeDataset
+
+
+patterns = ['house', 'House \\d', '\\x48ouse', '\\u0048ouse', '\\U00000048ouse',
+            '\\N{LATIN CAPITAL LETTER H}ouse', '\\110ouse', 'hou?se', 'hous*e', 'ho{1,2}use',
+            '(?x) hou se', '(?i)HOUSE', '[hH]ouse', 'doc(tor)? news', '(news) \\1',
+            'news|crime', '^History', '\\bnews\\b', 'news\\.', 'a.b.c',
+            'istanbul', 'İST', 'ıstanbul', 'house', 'HOUSE', 'kelvin', 'straße']
+
+titles = ['House', 'Dr. House', 'İstanbul', 'ISTANBUL', 'houſe', 'KELVIN', 'Straße', 'news. crime',
+          'Doctor news', 'news news', 'axbxc', 'History', 'Hoouse 2']
+
+
+def candidates(texts, pattern):
+    index = TrigramIndex(fields=('title',))
+    for id, text in enumerate(texts):
+        index.add(id, {'title': text})
+
+    return index.candidates('title', pattern)
+
+
+
+def brute_force(texts, pattern):
+    search = re.compile(pattern, re.IGNORECASE).search
+    return set(id for id, text in enumerate(texts) if search(text))
+
+
+
+@pytest.mark.parametrize('pattern', patterns)
+def test_candidates_hold_every_match(pattern):
+    found = candidates(titles, pattern)
+    assert found == None or brute_force(titles, pattern) <= found
+
+
+
+def test_case_folding():
+    # re.IGNORECASE matches these, lower() alone doesn't fold them
+    assert candidates(['İstanbul'], 'istanbul') == {0}
+    assert candidates(['istanbul'], 'İST') == {0}
+    assert candidates(['houſe'], 'house') == {0}
+    assert candidates(['Kelvin'], 'kelvin') == {0}
+
+
+
+def test_random_texts():
+    random.seed(3)
+    alphabet = 'abiksIKS İıſKäÄß'
+    texts = [''.join(random.choice(alphabet) for _ in range(random.randint(0, 12))) for _ in range(500)]
+
+    for _ in range(500):
+        pattern = ''.join(random.choice(alphabet) for _ in range(random.randint(3, 5)))
+        found = candidates(texts, pattern)
+        assert found == None or brute_force(texts, pattern) <= found, pattern
+
+
+
+def test_required_literals():
+    assert required_literals('house') == ['house']
+    assert required_literals('hou?se') == []
+    assert required_literals('house?s') == ['hous']
+    assert required_literals('news|crime') == []
+    assert required_literals('(?x) hou se') == []
+    assert required_literals('\\x48ouse') == ['ouse']
+    assert required_literals('doc(tor)? news') == ['doc', ' news']
+    assert pattern_trigrams('ab') == set()
+
+
+
+def test_remove():
+    index = TrigramIndex(fields=('title',))
+    index.add(1, {'title': 'House'})
+    index.add(2, {'title': 'Houses'})
+    index.remove(1, {'title': 'House'})
+    assert index.candidates('title', 'house') == {2}
+    assert len(index) == 1
+
+
+
+@pytest.mark.parametrize('field', ['title', 'subtitle'])
+def test_store_search_matches_scan(field):
+    store = HtspStateStore()
+    store.enable_text_index()
+    for record in HtspFakeDataset(records=2000).records.values():
+        store.add_record(dict(record))
+
+    store.add_record({'id': 100001, 'start': 0, 'stop': 1, 'channel': 1, 'title': 'İstanbul', 'subtitle': 'houſe'})
+
+    fieldtypes = {'id': int, 'start': int, 'stop': int}
+    for pattern in patterns:
+        query = tvhcquery.parse_query(['%s:%s' % (field, pattern)])
+        indexed = sorted(r['id'] for r in tvhcquery.search_records(query, store, fieldtypes))
+        scanned = sorted(r['id'] for r in tvhcquery.apply(query, store.records_sorted(), fieldtypes, True))
+        assert indexed == scanned, pattern
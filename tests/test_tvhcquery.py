@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import pytest
+from datetime import datetime
+from tvhc import tvhcquery
+
+
+fieldtypes = {'id': int, 'start': int, 'startdate': datetime}
+
+items = [{'id': 1, 'start': 100, 'title': 'House', 'startdate': datetime(2020, 1, 1)},
+         {'id': 2, 'start': 300, 'title': 'News', 'startdate': datetime(2020, 1, 3)},
+         {'id': 3, 'start': 200, 'title': 'Dr. House', 'startdate': datetime(2020, 1, 2)},
+         {'id': 4, 'start': 400, 'startdate': datetime(2020, 1, 4)}]
+
+
+def find(*queries, now=None):
+    return [item['id'] for item in tvhcquery.apply(tvhcquery.parse_query(queries, now), items, fieldtypes)]
+
+
+
+def test_regex_ignores_case():
+    assert find('title:house') == [1, 3]
+    assert find('title:^house') == [1]
+
+
+
+def test_numbers_and_ranges():
+    assert find('id:2') == [2]
+    assert find('id:>2') == [3, 4]
+    assert find('start:<300') == [1, 3]
+    assert find('start:200..300') == [2, 3]
+
+
+
+def test_dates():
+    assert find('startdate:<2020-01-02') == [1]
+    assert find('startdate:2020-01-02..2020-01-03') == [2, 3]
+
+
+
+def test_negation_and_alternatives():
+    assert find('!title:house') == [2, 4]
+    assert find('not title:house') == [2, 4]
+    assert find('title:news || id:1') == [1, 2]
+
+
+
+def test_sort_and_limit():
+    assert find('sort:start') == [1, 3, 2, 4]
+    assert find('sort:-start', 'limit:2') == [4, 2]
+    assert find('sort:title') == [3, 1, 2, 4]
+    assert find('all', 'limit:0') == []
+
+
+
+def test_next():
+    # the very next one only, if not sorted or limited otherwise
+    assert tvhcquery.parse_query(['next'], now=150).limit == 1
+    assert find('next', now=350) == [4]
+    assert find('next', 'sort:start', now=150) == [3, 2, 4]
+
+
+
+def test_errors():
+    for query in ('title', 'id:abc', 'limit:x', 'startdate:soon', 'title:('):
+        with pytest.raises(tvhcquery.QueryError):
+            find(query)